@@ -0,0 +1,331 @@
+"""Offline benchmarks for the daily brief pipeline.
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --only news_cold news_warm prompt --repeat 10
+    python benchmarks/bench.py --http-latency 0.2 --sheet-rows 2000 --json bench.json
+
+Yahoo, NSE, the RSS feeds, article pages, Google Sheets and OpenAI are
+all replaced by the stand-ins in standins.py serving the fixtures in
+benchmarks/fixtures, with the latencies given on the command line.
+Every run gets a fresh cache directory unless the benchmark is
+explicitly a warm one.
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import runpy
+import statistics
+import sys
+import tempfile
+import time
+
+import feedparser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_PATH = os.path.join(os.path.dirname(BENCH_DIR), "generate_daily_brief.py")
+
+sys.path.insert(0, BENCH_DIR)
+
+import standins  # noqa: E402
+
+
+def fresh_cache_dir():
+    return tempfile.mkdtemp(prefix="brief-bench-")
+
+
+@contextlib.contextmanager
+def quiet():
+
+    # The pipeline prints a lot; keep benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def run_pipeline(cache_dir, argv=()):
+
+    os.environ["BRIEF_CACHE_DIR"] = cache_dir
+    os.environ["METRICS_REPORT_PATH"] = os.path.join(cache_dir, "run_report.json")
+
+    # A fresh module per run, so in-memory caches start empty too;
+    # run_path hands back a copy, the functions see the real globals
+    ns = runpy.run_path(SCRIPT_PATH, run_name="daily_brief_bench")["main"].__globals__
+
+    with quiet():
+        ns["main"](list(argv))
+
+    return ns
+
+
+def point_caches_at(ns, cache_dir):
+
+    # Rebinds the module-level cache locations of an already loaded
+    # pipeline namespace and drops any open handles
+    ns["CACHE_DIR"] = cache_dir
+    ns["ARTICLE_CACHE_PATH"] = os.path.join(cache_dir, "articles.sqlite")
+    ns["FEED_STATE_PATH"] = os.path.join(cache_dir, "feeds.json")
+    ns["LLM_CACHE_DIR"] = os.path.join(cache_dir, "llm")
+    ns["INDICATOR_STORE_PATH"] = os.path.join(cache_dir, "indicator_history.npy")
+    ns["RUN_STATE_PATH"] = os.path.join(cache_dir, "run_state.json")
+    ns["DATE_INDEX_PATH"] = os.path.join(cache_dir, "sheet_dates.json")
+    ns["_article_cache_conn"] = None
+
+    # Each timed run starts like a fresh process, with full token buckets
+    ns["_rate_limiters"].clear()
+
+
+def reset_sheets(ns):
+    ns["_spreadsheet"] = None
+    ns["_worksheets"].clear()
+    ns["_date_indexes"].clear()
+    ns["_pending_writes"].clear()
+
+
+def fixture_articles():
+
+    # Title + body text of every recorded article page
+    articles = []
+
+    for name in ("businessline", "economictimes", "moneycontrol"):
+
+        feed = feedparser.parse(standins.fixture_path(f"feeds/{name}.xml"))
+
+        for i, entry in enumerate(feed.entries):
+
+            with open(standins.fixture_path(f"articles/{name}-{i}.html"), encoding="utf-8") as f:
+                html = f.read()
+
+            paragraphs = [
+                chunk.split("</p>")[0]
+                for chunk in html.split("<p>")[1:]
+            ]
+
+            articles.append({
+                "title": entry.title,
+                "link": entry.link,
+                "text": "\n".join(paragraphs)
+            })
+
+    return articles
+
+
+def fixture_entries():
+
+    entries = []
+
+    for name in ("businessline", "economictimes", "moneycontrol"):
+
+        for entry in feedparser.parse(standins.fixture_path(f"feeds/{name}.xml")).entries:
+            entries.append({
+                "id": entry.id,
+                "title": entry.title,
+                "link": entry.link,
+                "summary": entry.get("summary", "")
+            })
+
+    return entries
+
+
+def build_benchmarks(ns, stand_ins):
+
+    articles = fixture_articles()
+    entries = fixture_entries()
+    panel = standins.load_quote_fixture()
+
+    history_rows = [
+        row[:4]
+        for row in stand_ins.spreadsheet.worksheets[0].rows[-5:]
+    ]
+
+    sections = {
+        "report_date": "17 Oct 2026",
+        "trade_date": "16 Oct 2026",
+        "market_data": "NIFTY 50: 24680.00 (-150.00, -0.60%)",
+        "global_data": "S&P 500: 5900.00 (+10.00, 0.17%)",
+        "flows": "FII Net Flow: ₹-2,577.22 Cr\nDII Net Flow: ₹3,270.75 Cr",
+        "sector_data": "SECTORS (1D / 5D):\n  IT: -1.10% / -2.40%"
+    }
+
+    warm_dir = fresh_cache_dir()
+    incremental_dir = fresh_cache_dir()
+
+    def news_cold():
+        point_caches_at(ns, fresh_cache_dir())
+        with quiet():
+            ns["fetch_market_news"]()
+
+    def news_warm():
+        point_caches_at(ns, warm_dir)
+        with quiet():
+            ns["fetch_market_news"]()
+
+    def relevance():
+        for entry in entries:
+            ns["prefilter_entry"](entry)
+        for article in articles:
+            ns["is_market_relevant"](article["title"] + " " + article["text"])
+
+    routes = standins.load_json_fixture("routes.json")
+
+    pages = []
+
+    for url, route in routes.items():
+        if route["file"].startswith("articles/"):
+            with open(standins.fixture_path(route["file"]), "rb") as f:
+                pages.append((url, f.read()))
+
+    def article_parse():
+        for url, html in pages:
+            ns["fast_extract_text"](html, url)
+
+    def rss_parse():
+        for name in ("businessline", "economictimes", "moneycontrol"):
+            feedparser.parse(standins.fixture_path(f"feeds/{name}.xml"))
+
+    def dedup():
+        # Every article three times with light edits, as syndication does
+        corpus = [
+            {**article, "title": f"{article['title']} ({copy})", "text": article["text"] + f" Edition {copy}."}
+            for copy in range(3)
+            for article in articles
+        ]
+        with quiet():
+            ns["dedupe_articles"](corpus)
+
+    def prompt():
+        with quiet():
+            ns["build_analysis_input"](sections, articles, history_rows)
+
+    def indicators():
+        ns["compute_indicators"](panel)
+
+    def sheets_upsert():
+        reset_sheets(ns)
+        with quiet():
+            ns["queue_row_upsert"](["16 Oct 2026", "m", "g", "f", "n", "b"], "16 Oct 2026")
+            ns["queue_row_upsert"](["16 Oct 2026"] + [1.0] * 11, "16 Oct 2026", "Indicator_History")
+            ns["flush_sheet_writes"]()
+
+    def sheets_history():
+        reset_sheets(ns)
+        ns["fetch_history_rows"]()
+
+    def backfill():
+        point_caches_at(ns, fresh_cache_dir())
+        reset_sheets(ns)
+        ns["_quote_panel_cache"].clear()
+        with quiet():
+            ns["backfill_indicator_history"](datetime.date(2026, 7, 20), datetime.date(2026, 10, 16))
+
+    def end_to_end_cold():
+        run_pipeline(fresh_cache_dir())
+
+    def end_to_end_warm():
+        run_pipeline(warm_dir)
+
+    def incremental_warm():
+        # An intraday re-run with nothing new since the previous one
+        run_pipeline(incremental_dir, ["--incremental"])
+
+    def all_briefs_cold():
+        run_pipeline(fresh_cache_dir(), ["--briefs", "all"])
+
+    return {
+        "end_to_end_cold": end_to_end_cold,
+        "end_to_end_warm": end_to_end_warm,
+        "incremental_warm": incremental_warm,
+        "all_briefs_cold": all_briefs_cold,
+        "news_cold": news_cold,
+        "news_warm": news_warm,
+        "rss_parse": rss_parse,
+        "article_parse": article_parse,
+        "relevance": relevance,
+        "dedup": dedup,
+        "prompt": prompt,
+        "indicators": indicators,
+        "sheets_upsert": sheets_upsert,
+        "sheets_history": sheets_history,
+        "backfill": backfill
+    }
+
+
+def measure(func, repeat):
+
+    samples = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    return {
+        "runs": repeat,
+        "min_ms": round(min(samples) * 1000, 3),
+        "median_ms": round(statistics.median(samples) * 1000, 3),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3)
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="*", help="benchmark names to run")
+    parser.add_argument("--http-latency", type=float, default=0.05)
+    parser.add_argument("--yfinance-latency", type=float, default=0.5)
+    parser.add_argument("--sheets-latency", type=float, default=0.15)
+    parser.add_argument("--openai-latency", type=float, default=0.8)
+    parser.add_argument("--tokens-per-second", type=float, default=120)
+    parser.add_argument("--sheet-rows", type=int, default=250)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    stand_ins = standins.install(
+        standins.Latency(
+            http=args.http_latency,
+            yfinance=args.yfinance_latency,
+            sheets=args.sheets_latency,
+            openai=args.openai_latency,
+            tokens_per_second=args.tokens_per_second
+        ),
+        sheet_rows=args.sheet_rows
+    )
+
+    # One warm-up load gives the namespace the function benchmarks use
+    ns = run_pipeline(fresh_cache_dir())
+
+    benchmarks = build_benchmarks(ns, stand_ins)
+
+    names = args.only or list(benchmarks)
+    results = {}
+
+    print(f"{'benchmark':<18} {'runs':>5} {'min ms':>10} {'median ms':>10} {'mean ms':>10}  calls")
+
+    for name in names:
+
+        # Warm benchmarks measure the second and later runs only
+        if name.endswith("_warm"):
+            benchmarks[name]()
+
+        stand_ins.log.reset()
+
+        result = measure(benchmarks[name], args.repeat)
+        result["calls"] = dict(sorted(stand_ins.log.calls.items()))
+        results[name] = result
+
+        print(
+            f"{name:<18} {result['runs']:>5} {result['min_ms']:>10.1f} "
+            f"{result['median_ms']:>10.1f} {result['mean_ms']:>10.1f}  "
+            f"{sum(result['calls'].values()) / args.repeat:.1f}/run"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
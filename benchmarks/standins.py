@@ -0,0 +1,419 @@
+"""Offline stand-ins for every external service the brief talks to.
+
+Each stand-in serves the recorded fixtures in benchmarks/fixtures and
+sleeps for a configurable latency per request, so timings are
+reproducible on a machine with no network access:
+
+- HTTP (requests): RSS feeds, article pages, NSE and the NIFTY 50 list,
+  with ETag / If-None-Match support
+- yfinance.download: the recorded close panel
+- gspread: an in-memory spreadsheet built from template rows
+- OpenAI: canned completions, blocking or streamed
+"""
+
+import io
+import json
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import gspread
+import openai
+import pandas as pd
+import requests
+import yfinance
+from google.oauth2.service_account import Credentials
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture_path(name):
+    return os.path.join(FIXTURES_DIR, name)
+
+
+def load_json_fixture(name):
+    with open(fixture_path(name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Latency:
+
+    def __init__(self, http=0.05, yfinance=0.5, sheets=0.15, openai=0.8, tokens_per_second=120):
+        self.http = http
+        self.yfinance = yfinance
+        self.sheets = sheets
+        self.openai = openai
+        self.tokens_per_second = tokens_per_second
+
+
+class CallLog:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def add(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+
+
+# ---------------- HTTP ----------------
+class FixtureAdapter(BaseAdapter):
+
+    def __init__(self, latency, log):
+        super().__init__()
+        self.routes = load_json_fixture("routes.json")
+        self.latency = latency
+        self.log = log
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+
+        time.sleep(self.latency.http)
+        self.log.add("http")
+
+        route = self.routes.get(request.url) or self.routes.get(request.url.rstrip("/"))
+
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        response.headers = CaseInsensitiveDict()
+
+        if route is None:
+            response.status_code = 404
+            response.reason = "Not Found"
+            content = b""
+
+        elif route.get("etag") and request.headers.get("If-None-Match") == route["etag"]:
+            response.status_code = 304
+            response.reason = "Not Modified"
+            response.headers["ETag"] = route["etag"]
+            content = b""
+
+        else:
+            with open(fixture_path(route["file"]), "rb") as f:
+                content = f.read()
+
+            response.status_code = 200
+            response.reason = "OK"
+            response.headers["Content-Type"] = route["content_type"]
+            response.headers["Content-Length"] = str(len(content))
+
+            if route.get("etag"):
+                response.headers["ETag"] = route["etag"]
+            if route.get("last_modified"):
+                response.headers["Last-Modified"] = route["last_modified"]
+
+        response.raw = io.BytesIO(content)
+
+        return response
+
+    def close(self):
+        pass
+
+
+# ---------------- YFINANCE ----------------
+def load_quote_fixture():
+    return pd.read_csv(fixture_path("quotes.csv"), index_col=0, parse_dates=True)
+
+
+def make_yf_download(latency, log):
+
+    closes = load_quote_fixture()
+
+    def download(tickers, period=None, start=None, end=None, **kwargs):
+
+        time.sleep(latency.yfinance)
+        log.add("yfinance")
+
+        if isinstance(tickers, str):
+            tickers = tickers.split()
+
+        frame = closes.reindex(columns=list(tickers))
+
+        if start is not None:
+            frame = frame[frame.index >= pd.Timestamp(start)]
+        if end is not None:
+            frame = frame[frame.index < pd.Timestamp(end)]
+
+        return pd.concat({"Close": frame}, axis=1)
+
+    return download
+
+
+# ---------------- GOOGLE SHEETS ----------------
+RANGE_RE = re.compile(r"^([A-Z]+)(\d+):([A-Z]+)(\d+)$")
+
+
+def column_index(letters):
+
+    index = 0
+
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+
+    return index
+
+
+def expand_sheet_rows(template_rows, n_rows, end="2026-10-15"):
+
+    # Header plus n_rows daily rows, cycling through the recorded
+    # templates with their dates rewritten
+    header, templates = template_rows[0], template_rows[1:]
+
+    rows = [list(header)]
+
+    for i, day in enumerate(pd.bdate_range(end=end, periods=n_rows)):
+        row = list(templates[i % len(templates)])
+        row[0] = day.strftime("%d %b %Y")
+        rows.append(row)
+
+    return rows
+
+
+def cell_value(cell):
+
+    value = cell.get("userEnteredValue", {})
+
+    for key in ("stringValue", "numberValue", "boolValue"):
+        if key in value:
+            return value[key]
+
+    return ""
+
+
+class FakeWorksheet:
+
+    def __init__(self, title, sheet_id, rows, latency, log):
+        self.title = title
+        self.id = sheet_id
+        self.rows = rows
+        self.latency = latency
+        self.log = log
+
+    def _call(self, name):
+        time.sleep(self.latency.sheets)
+        self.log.add(f"sheets.{name}")
+
+    @property
+    def row_count(self):
+        return max(len(self.rows), 1000)
+
+    def col_values(self, col):
+
+        self._call("col_values")
+
+        values = [row[col - 1] if len(row) >= col else "" for row in self.rows]
+
+        while values and values[-1] == "":
+            values.pop()
+
+        return values
+
+    def _slice(self, range_name):
+
+        first_col, first_row, last_col, last_row = RANGE_RE.match(range_name).groups()
+
+        return [
+            [str(value) for value in row[column_index(first_col) - 1:column_index(last_col)]]
+            for row in self.rows[int(first_row) - 1:int(last_row)]
+        ]
+
+    def get(self, range_name, **kwargs):
+        self._call("get")
+        return self._slice(range_name)
+
+    def batch_get(self, ranges, **kwargs):
+        self._call("batch_get")
+        return [self._slice(range_name) for range_name in ranges]
+
+    def set_row(self, row_number, values):
+
+        while len(self.rows) < row_number:
+            self.rows.append([])
+
+        row = self.rows[row_number - 1]
+        row[:len(values)] = values
+
+
+class FakeSpreadsheet:
+
+    def __init__(self, sheets, latency, log):
+        self.latency = latency
+        self.log = log
+        self.worksheets = [
+            FakeWorksheet(title, sheet_id, rows, latency, log)
+            for sheet_id, (title, rows) in enumerate(sheets.items())
+        ]
+
+    def _call(self, name):
+        time.sleep(self.latency.sheets)
+        self.log.add(f"sheets.{name}")
+
+    @property
+    def sheet1(self):
+        return self.get_worksheet(0)
+
+    def get_worksheet(self, index):
+        self._call("get_worksheet")
+        return self.worksheets[index]
+
+    def worksheet(self, title):
+
+        self._call("worksheet")
+
+        for sheet in self.worksheets:
+            if sheet.title == title:
+                return sheet
+
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def by_id(self, sheet_id):
+        return next(sheet for sheet in self.worksheets if sheet.id == sheet_id)
+
+    def batch_update(self, body):
+
+        self._call("batch_update")
+
+        for request in body["requests"]:
+
+            if "insertDimension" in request:
+
+                dimension = request["insertDimension"]["range"]
+                sheet = self.by_id(dimension["sheetId"])
+
+                sheet.rows[dimension["startIndex"]:dimension["startIndex"]] = [
+                    [] for _ in range(dimension["endIndex"] - dimension["startIndex"])
+                ]
+
+            elif "updateCells" in request:
+
+                update = request["updateCells"]
+                sheet = self.by_id(update["start"]["sheetId"])
+
+                for offset, row in enumerate(update["rows"]):
+                    sheet.set_row(
+                        update["start"]["rowIndex"] + 1 + offset,
+                        [cell_value(cell) for cell in row["values"]]
+                    )
+
+            elif "appendCells" in request:
+
+                append = request["appendCells"]
+                sheet = self.by_id(append["sheetId"])
+
+                for row in append["rows"]:
+                    sheet.rows.append([cell_value(cell) for cell in row["values"]])
+
+        return {"replies": [{} for _ in body["requests"]]}
+
+
+def make_spreadsheet(sheet_rows, latency, log):
+
+    templates = load_json_fixture("sheet_rows.json")
+
+    return FakeSpreadsheet(
+        {
+            title: expand_sheet_rows(rows, sheet_rows)
+            for title, rows in templates.items()
+        },
+        latency,
+        log
+    )
+
+
+# ---------------- OPENAI ----------------
+class FakeOpenAI:
+
+    completions = None
+
+    def __init__(self, api_key=None, latency=None, log=None, **kwargs):
+
+        self.latency = latency or Latency()
+        self.log = log or CallLog()
+
+        if FakeOpenAI.completions is None:
+            FakeOpenAI.completions = load_json_fixture("completions.json")
+
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self.create)
+        )
+
+    def create(self, model, messages, stream=False, **kwargs):
+
+        self.log.add("openai")
+
+        content = self.completions.get(messages[0]["content"], self.completions["default"])
+
+        usage = SimpleNamespace(
+            prompt_tokens=sum(len(message["content"]) for message in messages) // 4,
+            completion_tokens=len(content) // 4
+        )
+
+        if not stream:
+
+            time.sleep(self.latency.openai + usage.completion_tokens / self.latency.tokens_per_second)
+
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                usage=usage
+            )
+
+        return self.stream(content, usage)
+
+    def stream(self, content, usage):
+
+        time.sleep(self.latency.openai)
+
+        pieces = re.findall(r"\S+\s*|\s+", content)
+
+        for piece in pieces:
+
+            time.sleep(1 / self.latency.tokens_per_second)
+
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))],
+                usage=None
+            )
+
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+# ---------------- INSTALL ----------------
+def install(latency=None, sheet_rows=250):
+
+    # Patches the libraries in place; import generate_daily_brief after
+    # this so its module-level names bind to the stand-ins
+    latency = latency or Latency()
+    log = CallLog()
+
+    adapter = FixtureAdapter(latency, log)
+    spreadsheet = make_spreadsheet(sheet_rows, latency, log)
+
+    requests.Session.get_adapter = lambda self, url: adapter
+    yfinance.download = make_yf_download(latency, log)
+
+    gspread.authorize = lambda creds, **kwargs: SimpleNamespace(
+        open_by_key=lambda key: spreadsheet
+    )
+    Credentials.from_service_account_info = classmethod(lambda cls, info, **kwargs: None)
+
+    openai.OpenAI = lambda **kwargs: FakeOpenAI(latency=latency, log=log, **kwargs)
+
+    os.environ.setdefault("GOOGLE_SERVICE_ACCOUNT", "{}")
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+
+    return SimpleNamespace(
+        latency=latency,
+        log=log,
+        adapter=adapter,
+        spreadsheet=spreadsheet
+    )
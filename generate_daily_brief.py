@@ -1,818 +1,4239 @@
-import pandas as pd
+import argparse
+import numpy as np
 from io import StringIO
-from bs4 import BeautifulSoup
-from newspaper import Article
-import requests
 import datetime
 import os
-from openai import OpenAI
-import yfinance as yf
-import feedparser
-import gspread
+import random
+import hashlib
+import io
 import json
+import math
+import numbers
 import re
-from google.oauth2.service_account import Credentials
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+import time
+import warnings
+import zlib
+from dataclasses import dataclass, fields
+from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
+
+# pandas, yfinance, requests, feedparser, newspaper, lxml, openai and
+# gspread are imported inside the functions that use them, so importing
+# this module is cheap and has no side effects.
+
+CACHE_DIR = os.getenv("BRIEF_CACHE_DIR", ".cache")
+
+# ---------------- METRICS ----------------
+METRICS_REPORT_PATH = os.getenv("METRICS_REPORT_PATH", "run_report.json")
+METRICS_PROMETHEUS_PATH = os.getenv("METRICS_PROMETHEUS_PATH")
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "started_at": time.time(),
+    "timers": {},
+    "counters": {}
+}
+
+
+def record_timing(stage, seconds):
+
+    with _metrics_lock:
+
+        timer = _metrics["timers"].setdefault(
+            stage,
+            {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        )
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        timer["calls"] += 1
+        timer["total_seconds"] += seconds
+        timer["max_seconds"] = max(timer["max_seconds"], seconds)
 
-# ---------------- FETCH LIVE MARKET DATA ----------------
-def fetch_market_data():
-    try:
-        nifty = yf.Ticker("^NSEI")
-        banknifty = yf.Ticker("^NSEBANK")
-        sensex = yf.Ticker("^BSESN")
-
-        nifty_hist = nifty.history(period="5d")
-        bank_hist = banknifty.history(period="5d")
-        sensex_hist = sensex.history(period="5d")
-
-        if len(nifty_hist) < 2 or len(bank_hist) < 2 or len(sensex_hist) < 2:
-            return {
-                "trade_date": "Unknown",
-                "data": "Market data unavailable."
-            }
 
-        nifty_close = nifty_hist["Close"].iloc[-1]
-        bank_close = bank_hist["Close"].iloc[-1]
-        sensex_close = sensex_hist["Close"].iloc[-1]
+@contextmanager
+def timed(stage):
 
-        nifty_prev = nifty_hist["Close"].iloc[-2]
-        bank_prev = bank_hist["Close"].iloc[-2]
-        sensex_prev = sensex_hist["Close"].iloc[-2]
+    # Works as a context manager or as a function decorator
+    start = time.perf_counter()
 
-        nifty_points = nifty_close - nifty_prev
-        bank_points = bank_close - bank_prev
-        sensex_points = sensex_close - sensex_prev
+    try:
+        yield
+    finally:
+        record_timing(stage, time.perf_counter() - start)
 
-        nifty_change = (nifty_points / nifty_prev) * 100
-        bank_change = (bank_points / bank_prev) * 100
-        sensex_change = (sensex_points / sensex_prev) * 100
 
-        trade_date = nifty_hist.index[-1].strftime("%d %b %Y")
-        trade_date_str = trade_date
-        max_move = max(abs(nifty_change), abs(bank_change), abs(sensex_change))
+def count(name, amount=1):
 
-        if max_move < 0.5:
-           regime = "Low Volatility Session"
-        elif max_move < 1:
-           regime = "Moderate Volatility Session"
-        else:
-           regime = "High Volatility Session"
-        return {
-            "trade_date": trade_date_str,
+    with _metrics_lock:
+        _metrics["counters"][name] = _metrics["counters"].get(name, 0) + amount
 
-            "nifty": round(nifty_close, 2),
-            "bank_nifty": round(bank_close, 2),
-            "sensex": round(sensex_close, 2),
 
-            "data": f"""
-        Trade Date: {trade_date}
-        Session Type: {regime}
+def record_http(response):
 
-        NIFTY 50: {nifty_close:.2f} ({nifty_points:+.2f}, {nifty_change:.2f}%)
-        BANK NIFTY: {bank_close:.2f} ({bank_points:+.2f}, {bank_change:.2f}%)
-        SENSEX: {sensex_close:.2f} ({sensex_points:+.2f}, {sensex_change:.2f}%)
-        """
-        }
+    count("http_calls")
+    count("bytes_downloaded", len(response.content))
 
-    except Exception:
 
-        return {
-            "trade_date": "Unknown",
-            "data": "Market data unavailable."
-        }
-# ---------------- FETCH GLOBAL MARKET DATA ----------------
-def fetch_global_data():
-    try:
-        sp500 = yf.Ticker("^GSPC")
-        nasdaq = yf.Ticker("^IXIC")
-        dow = yf.Ticker("^DJI")
-        usd_inr = yf.Ticker("INR=X")
-        brent = yf.Ticker("BZ=F")
-        india_vix = yf.Ticker("^INDIAVIX")
-        gold = yf.Ticker("GC=F")
-        silver = yf.Ticker("SI=F")
-        # US 10-Year Treasury Yield
-        gsec = yf.Ticker("^TNX")
-
-        sp_hist = sp500.history(period="5d")
-        nas_hist = nasdaq.history(period="5d")
-        dow_hist = dow.history(period="5d")
-        usd_hist = usd_inr.history(period="5d")
-        brent_hist = brent.history(period="5d")
-        vix_hist = india_vix.history(period="5d")
-        gold_hist = gold.history(period="5d")
-        silver_hist = silver.history(period="5d")
-        gsec_hist = gsec.history(period="5d")
-
-        def calc(hist):
-            close = hist["Close"].iloc[-1]
-            prev = hist["Close"].iloc[-2]
-            points = close - prev
-            pct = (points / prev) * 100
-            return close, points, pct
-
-        sp_close, sp_pts, sp_pct = calc(sp_hist)
-        nas_close, nas_pts, nas_pct = calc(nas_hist)
-        dow_close, dow_pts, dow_pct = calc(dow_hist)
-        usd_close, usd_pts, usd_pct = calc(usd_hist)
-        brent_close, brent_pts, brent_pct = calc(brent_hist)
-        vix_close, vix_pts, vix_pct = calc(vix_hist)
-        gold_close, gold_pts, gold_pct = calc(gold_hist)
-        silver_close, silver_pts, silver_pct = calc(silver_hist)
-        gsec_close, gsec_pts, gsec_pct = calc(gsec_hist)
+def write_run_report(extra=None):
 
-        return {
+    with _metrics_lock:
 
-            "vix": round(vix_close, 2),
-            "brent": round(brent_close, 2),
-            "usdinr": round(usd_close, 2),
-            "us10y": round(gsec_close, 2),
-            "gold": round(gold_close, 2),
-            "silver": round(silver_close, 2),
-
-            "data": f"""
-        S&P 500: {sp_close:.2f} ({sp_pts:+.2f}, {sp_pct:.2f}%)
-        NASDAQ: {nas_close:.2f} ({nas_pts:+.2f}, {nas_pct:.2f}%)
-        DOW JONES: {dow_close:.2f} ({dow_pts:+.2f}, {dow_pct:.2f}%)
-        USD/INR: {usd_close:.2f} ({usd_pts:+.2f}, {usd_pct:.2f}%)
-        BRENT CRUDE: {brent_close:.2f} ({brent_pts:+.2f}, {brent_pct:.2f}%)
-        INDIA VIX: {vix_close:.2f} ({vix_pts:+.2f}, {vix_pct:.2f}%)
-        US 10Y TREASURY YIELD: {gsec_close:.2f} ({gsec_pts:+.2f}, {gsec_pct:.2f}%)
-        GOLD: {gold_close:.2f} ({gold_pts:+.2f}, {gold_pct:.2f}%)
-        SILVER: {silver_close:.2f} ({silver_pts:+.2f}, {silver_pct:.2f}%)
-        """
+        report = {
+            "started_at": datetime.datetime.fromtimestamp(
+                _metrics["started_at"],
+                datetime.timezone.utc
+            ).isoformat(),
+            "duration_seconds": round(time.time() - _metrics["started_at"], 3),
+            "timers": {
+                stage: {key: round(value, 4) for key, value in timer.items()}
+                for stage, timer in sorted(_metrics["timers"].items())
+            },
+            "counters": dict(sorted(_metrics["counters"].items())),
+            **(extra or {})
         }
-    except Exception:
-        return "Global data unavailable."
-# ---------------- FETCH FII / DII DATA FROM NSE ----------------
-def fetch_fii_dii_data():
 
     try:
+        with open(METRICS_REPORT_PATH, "w") as f:
+            json.dump(report, f, indent=2)
 
-        session = requests.Session()
+        if METRICS_PROMETHEUS_PATH:
+            with open(METRICS_PROMETHEUS_PATH, "w") as f:
+                f.write(prometheus_text(report))
 
-        headers = {
-            "User-Agent": "Mozilla/5.0",
-            "Referer": "https://www.nseindia.com/reports/fii-dii"
-        }
+    except OSError as e:
+        print("RUN REPORT ERROR:", e)
 
-        session.get(
-            "https://www.nseindia.com",
-            headers=headers,
-            timeout=10
-        )
+    return report
 
-        response = session.get(
-            "https://www.nseindia.com/api/fiidiiTradeNse?csv=true",
-            headers=headers,
-            timeout=10
-        )
 
-        response.raise_for_status()
+def prometheus_text(report):
 
-        lines = response.text.splitlines()
+    lines = [
+        "# TYPE brief_run_duration_seconds gauge",
+        f"brief_run_duration_seconds {report['duration_seconds']}",
+        "# TYPE brief_stage_seconds_total counter",
+        "# TYPE brief_stage_calls_total counter",
+        "# TYPE brief_stage_seconds_max gauge"
+    ]
 
-        dii_line = None
-        fii_line = None
+    for stage, timer in report["timers"].items():
+        lines.append(f'brief_stage_seconds_total{{stage="{stage}"}} {timer["total_seconds"]}')
+        lines.append(f'brief_stage_calls_total{{stage="{stage}"}} {timer["calls"]}')
+        lines.append(f'brief_stage_seconds_max{{stage="{stage}"}} {timer["max_seconds"]}')
 
-        for line in lines:
+    for name, value in report["counters"].items():
+        lines.append(f"# TYPE brief_{name}_total counter")
+        lines.append(f"brief_{name}_total {value}")
 
-            if '"DII"' in line:
-                dii_line = line
+    return "\n".join(lines) + "\n"
 
-            if '"FII/FPI"' in line:
-                fii_line = line
 
-        if not dii_line or not fii_line:
-            raise Exception("Could not locate DII/FII rows")
+# ---------------- HTTP TRANSPORT ----------------
+# One pooled session for every fetcher: connections stay alive between
+# requests to the same host, 429/5xx responses on GETs are retried with
+# backoff (honouring Retry-After), and each host gets a token bucket so
+# concurrent workers cannot burst past what the site tolerates.
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
 
-        dii_parts = [x.strip('"') for x in dii_line.split('","')]
-        fii_parts = [x.strip('"') for x in fii_line.split('","')]
+# Hosts kept in the pool, and connections kept open per host
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "16"))
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", "4"))
 
-        date = fii_parts[1]
-        dii_net = dii_parts[4]
-        fii_net = fii_parts[4]
+HTTP_DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0"}
 
-        return f"""
-Source: NSE
+# (requests per second, burst) per host; NSE blocks aggressive clients
+HTTP_RATE_LIMITS = {
+    "www.nseindia.com": (1.0, 2),
+    "niftyindices.com": (1.0, 2),
+    "api.openai.com": (float(os.getenv("OPENAI_REQUESTS_PER_SECOND", "1")), 2)
+}
+HTTP_DEFAULT_RATE = (float(os.getenv("HTTP_RATE_PER_HOST", "5")), 5)
 
-Date: {date}
-FII Net Flow: ₹{fii_net} Cr
-DII Net Flow: ₹{dii_net} Cr
-"""
+_http_session = None
+_http_lock = threading.Lock()
+_rate_limiters = {}
+_warmed_up = set()
 
-    except Exception as e:
 
-        return f"""
-Source: NSE
+class TokenBucket:
 
-ERROR:
-{str(e)}
-"""
-# ---------------- FETCH LIVE NEWS ----------------
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
-def extract_article_text(url):
-    try:
-        article = Article(url)
-        article.download()
-        article.parse()
+    def acquire(self):
 
-        text = article.text
+        # Blocks until a token is available; sleeps outside the lock so
+        # other hosts' workers are never held up
+        while True:
 
-        # fallback if newspaper fails
-        if not text:
-            r = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=10)
-            soup = BeautifulSoup(r.text, "html.parser")
-            text = soup.get_text()
+            with self.lock:
 
-        return text[:3000]
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
 
-    except Exception:
-        return ""
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
 
+                delay = (1 - self.tokens) / self.rate
 
-def fetch_market_news():
-    try:
-        sources = [
-            "https://www.thehindubusinessline.com/markets/feeder/default.rss",
-            "https://economictimes.indiatimes.com/markets/rssfeeds/1977021501.cms",
-            "https://www.moneycontrol.com/rss/business.xml"
-        ]
+            count("http_rate_limited")
+            time.sleep(delay)
 
-        all_articles = []
-        market_keywords = [
-        "nifty",
-        "sensex",
-        "fii",
-        "dii",
-        "rbi",
-        "inflation",
-        "fed",
-        "crude",
-        "oil",
-        "rupee",
-        "economy",
-        "gdp",
-        "treasury yield",
-        "bond yield"
-]
 
-        for url in sources:
-            feed = feedparser.parse(url)
+def get_http_session():
+
+    global _http_session
+
+    with _http_lock:
 
-            for entry in feed.entries[:6]:
+        if _http_session is None:
 
-                title = entry.title.strip()
-                link = entry.link
-                
-                print("TITLE:", title)
-                print("LINK:", link)
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
 
-                article_text = extract_article_text(link)
+            retry = Retry(
+                total=HTTP_MAX_RETRIES,
+                backoff_factor=HTTP_BACKOFF_FACTOR,
+                status_forcelist=HTTP_RETRY_STATUSES,
+                allowed_methods=frozenset(["GET", "HEAD"]),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
 
-                print("ARTICLE LENGTH:", len(article_text))
-                print("==========================")
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_HOSTS,
+                pool_maxsize=HTTP_POOL_PER_HOST,
+                max_retries=retry
+            )
 
-                # fallback if scraping fails
-                if not article_text:
-                    if hasattr(entry, "summary"):
-                        article_text = entry.summary
-                    elif hasattr(entry, "description"):
-                        article_text = entry.description
-                    else:
-                        article_text = ""
+            session = requests.Session()
+            session.headers.update(HTTP_DEFAULT_HEADERS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
 
-                article_text = re.sub('<.*?>', '', article_text)
+            _http_session = session
 
-                article_block = f"""
-TITLE: {title}
+        return _http_session
 
-ARTICLE:
-{article_text}
-"""
 
-                combined_text = (title + " " + article_text).lower()
+def rate_limiter(host):
 
-                if any(keyword in combined_text for keyword in market_keywords):
+    with _http_lock:
 
-                    print("KEPT ARTICLE:", title)
+        if host not in _rate_limiters:
+            _rate_limiters[host] = TokenBucket(*HTTP_RATE_LIMITS.get(host, HTTP_DEFAULT_RATE))
 
-                    all_articles.append(article_block)
+        return _rate_limiters[host]
 
 
-        # remove duplicates
-        unique_articles = []
-        seen_titles = set()
+def http_request(method, url, **kwargs):
 
-        for article in all_articles:
-            title_line = article.split("TITLE: ")[1].split("\n")[0]
+    rate_limiter(urlsplit(url).hostname).acquire()
 
-            if title_line not in seen_titles:
-                seen_titles.add(title_line)
-                unique_articles.append(article)
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
 
-        if not unique_articles:
-            return "No relevant market news available."
+    response = get_http_session().request(method, url, **kwargs)
 
-        return "\n\n".join(unique_articles[:6])
+    record_http(response)
 
-    except Exception:
-        return "News data unavailable."
-# ---------------- DATE ----------------
-today = datetime.date.today().strftime("%d %b %Y")
-def extract_fii_dii_from_news(news_text):
+    return response
+
+
+def http_get(url, **kwargs):
+    return http_request("GET", url, **kwargs)
+
+
+def warm_up(url, headers=None, force=False):
+
+    # Sites like NSE only answer their APIs once the home page has set
+    # cookies. The session keeps them, so this runs once per host unless
+    # the cookies have expired and the caller forces a refresh. A failed
+    # warm-up is not remembered, so the next request tries again.
+    host = urlsplit(url).hostname
+
+    with _http_lock:
+        if host in _warmed_up and not force:
+            return
+        _warmed_up.discard(host)
+
+    count("http_warmups")
 
     try:
+        response = http_get(url, headers=headers)
 
-        prompt = f"""
-From the following financial news text extract institutional flows.
+    except Exception as e:
+        print("WARM-UP FAILED:", host, e)
+        return
+
+    if not 200 <= response.status_code < 300:
+        print("WARM-UP FAILED:", host, response.status_code)
+        return
+
+    with _http_lock:
+        _warmed_up.add(host)
+
+# ---------------- QUOTE PANEL ----------------
+INDIA_SYMBOLS = {
+    "nifty": "^NSEI",
+    "bank_nifty": "^NSEBANK",
+    "sensex": "^BSESN"
+}
+
+# In the order they appear in the brief
+GLOBAL_SYMBOLS = {
+    "sp500": "^GSPC",
+    "nasdaq": "^IXIC",
+    "dow": "^DJI",
+    "usdinr": "INR=X",
+    "brent": "BZ=F",
+    "vix": "^INDIAVIX",
+    # US 10-Year Treasury Yield
+    "us10y": "^TNX",
+    "gold": "GC=F",
+    "silver": "SI=F"
+}
+
+QUOTE_LABELS = {
+    "nifty": "NIFTY 50",
+    "bank_nifty": "BANK NIFTY",
+    "sensex": "SENSEX",
+    "sp500": "S&P 500",
+    "nasdaq": "NASDAQ",
+    "dow": "DOW JONES",
+    "usdinr": "USD/INR",
+    "brent": "BRENT CRUDE",
+    "vix": "INDIA VIX",
+    "us10y": "US 10Y TREASURY YIELD",
+    "gold": "GOLD",
+    "silver": "SILVER",
+    "us_vix": "CBOE VIX",
+    "russell": "RUSSELL 2000",
+    "wti": "WTI CRUDE",
+    "natgas": "NATURAL GAS",
+    "copper": "COPPER",
+    "dxy": "US DOLLAR INDEX",
+    "eurusd": "EUR/USD",
+    "usdjpy": "USD/JPY",
+    "us5y": "US 5Y TREASURY YIELD"
+}
+
+QUOTE_SYMBOLS = tuple(INDIA_SYMBOLS.values()) + tuple(GLOBAL_SYMBOLS.values())
+
+# Long enough for the 20-session statistics; still a single request
+QUOTE_PERIOD = os.getenv("QUOTE_PERIOD", "3mo")
+
+_quote_panel_cache = {}
+_quote_panel_lock = threading.Lock()
+
+# Briefs selected for this run; their symbols join the one download
+_active_briefs = []
+
+
+def panel_symbols():
+
+    # Everything the run needs, so the whole session costs one download.
+    # yf.download keeps module-level state and is not safe to run
+    # concurrently, which is another reason to keep it to one call.
+    # Sector indices and NIFTY 50 constituents are only downloaded when
+    # a selected brief reads them; with no briefs selected (direct
+    # callers) everything is.
+    sources = {name for config in _active_briefs for name in config.sources}
+
+    brief_symbols = tuple(
+        symbol
+        for config in _active_briefs
+        for symbol in config.symbols.values()
+    )
 
-Identify:
-- FII net flow
-- DII net flow
+    symbols = brief_symbols
 
-Return only this format:
+    if not _active_briefs or sources & {"market", "global"}:
+        symbols = QUOTE_SYMBOLS + symbols
 
-FII Net Flow: ₹____ crore
-DII Net Flow: ₹____ crore
+    if not _active_briefs or "sectors" in sources:
+        symbols += tuple(SECTOR_SYMBOLS.values()) + tuple(constituent_symbols())
 
-If flows are not mentioned return:
+    return tuple(dict.fromkeys(symbols))
 
-FII Net Flow: Not reported
-DII Net Flow: Not reported
 
-NEWS TEXT:
-{news_text}
-"""
+def fetch_quote_panel(symbols=None, period=QUOTE_PERIOD, start=None, end=None):
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You extract financial data from financial news."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0,
-            max_tokens=120
-        )
+    # One multi-ticker download for every symbol, shared by all callers.
+    # Rows are the union of trading days, so markets with different
+    # holidays show NaN on the days they were closed. start/end (ISO
+    # dates, end exclusive) replace period for fixed historical ranges.
+    import yfinance as yf
 
-        return response.choices[0].message.content
+    with _quote_panel_lock:
 
-    except Exception:
+        if symbols is None:
+            symbols = panel_symbols()
 
-        return "FII Net Flow: Not reported\nDII Net Flow: Not reported"
+        key = (tuple(symbols), period, start, end)
 
-# ---------------- HISTORICAL DATA ----------------
-def get_recent_market_history():
+        if key not in _quote_panel_cache:
 
-    try:
+            if start is not None:
+                window = {"start": start, "end": end}
+            else:
+                window = {"period": period}
 
-        creds_json = os.getenv("GOOGLE_SERVICE_ACCOUNT")
-        creds_dict = json.loads(creds_json)
+            with timed("yfinance.download"):
 
-        scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive"
-        ]
+                data = yf.download(
+                    list(symbols),
+                    **window,
+                    auto_adjust=True,
+                    group_by="column",
+                    progress=False,
+                    threads=True
+                )
 
-        creds = Credentials.from_service_account_info(
-            creds_dict,
-            scopes=scopes
-        )
+            count("http_calls")
+            count("yfinance_symbols", len(symbols))
 
-        client = gspread.authorize(creds)
+            _quote_panel_cache[key] = data["Close"].reindex(columns=list(symbols))
 
-        sheet = client.open_by_key(
-            "1vSuZmhAYVgBhTz4nx9g_fZnmV2ulEUJwisjIWfoQK64"
-        ).sheet1
+        return _quote_panel_cache[key]
 
-        rows = sheet.get_all_values()
 
-        # Remove duplicate dates
-        unique_rows = []
-        seen_dates = set()
+# ---------------- INDICATOR ENGINE ----------------
+RETURN_WINDOWS = (5, 20)
+VOLATILITY_WINDOW = 20
 
-        for row in reversed(rows):
 
-            if len(row) == 0:
-                continue
+def session_matrix(closes):
 
-            date_value = row[0]
+    # Pushes each column's valid closes to the bottom, keeping their
+    # order, so row -1 is every symbol's own last session, row -2 the one
+    # before, and so on, regardless of which calendar it trades on.
+    values = closes.to_numpy(dtype=float)
+    order = np.argsort(~np.isnan(values), axis=0, kind="stable")
 
-            if date_value not in seen_dates:
-                unique_rows.append(row)
-                seen_dates.add(date_value)
+    return np.take_along_axis(values, order, axis=0)
 
-            if len(unique_rows) == 5:
-                break
 
-        history = list(reversed(unique_rows))
+def compute_indicators(closes):
 
-        output = []
+    # closes: dates x symbols. Returns one row of statistics per symbol.
+    import pandas as pd
 
-        for row in history:
+    sessions = session_matrix(closes)
 
-            output.append(
-                f"""
-DATE: {row[0]}
+    with warnings.catch_warnings():
 
-MARKET:
-{row[1]}
+        warnings.simplefilter("ignore", RuntimeWarning)
 
-GLOBAL:
-{row[2]}
+        close = sessions[-1]
+        prev = sessions[-2] if len(sessions) > 1 else np.full_like(close, np.nan)
+        points = close - prev
 
-FLOWS:
-{row[3]}
-"""
-            )
+        daily = sessions[1:] / sessions[:-1] - 1
+        recent = daily[-VOLATILITY_WINDOW:]
+        baseline = daily[-VOLATILITY_WINDOW - 1:-1]
 
-        return "\n\n".join(output)
+        stats = {
+            "close": close,
+            "prev": prev,
+            "points": points,
+            "pct": points / prev * 100
+        }
 
-    except Exception as e:
+        for window in RETURN_WINDOWS:
 
-        return f"Historical data unavailable: {str(e)}"
-        
-# ---------------- LIVE DATA VARIABLES ----------------
-market_result = fetch_market_data()
-
-market_data = market_result["data"]
-trade_date = market_result["trade_date"]
-nifty_value = market_result["nifty"]
-bank_nifty_value = market_result["bank_nifty"]
-sensex_value = market_result["sensex"]
-print("NIFTY:", nifty_value)
-print("BANK NIFTY:", bank_nifty_value)
-print("SENSEX:", sensex_value)
-print("MARKET SESSION DATE:", trade_date)
-
-news_data = fetch_market_news()
-global_result = fetch_global_data()
-
-global_data = global_result["data"]
-
-vix_value = global_result["vix"]
-brent_value = global_result["brent"]
-usdinr_value = global_result["usdinr"]
-us10y_value = global_result["us10y"]
-gold_value = global_result["gold"]
-silver_value = global_result["silver"]
-
-print("VIX:", vix_value)
-print("BRENT:", brent_value)
-print("USDINR:", usdinr_value)
-print("US10Y:", us10y_value)
-print("GOLD:", gold_value)
-print("SILVER:", silver_value)
-
-historical_data = get_recent_market_history()
-
-print("----- HISTORICAL DATA -----")
-print(historical_data)
-print("---------------------------")
-
-print("----- GLOBAL DATA -----")
-print(global_data)
-print("-----------------------")
-
-fii_dii_data = fetch_fii_dii_data()
-
-if "unavailable" in fii_dii_data.lower():
-    fii_dii_data = """
-Source: NSE
+            if len(sessions) > window:
+                stats[f"ret_{window}d"] = (close / sessions[-1 - window] - 1) * 100
+            else:
+                stats[f"ret_{window}d"] = np.full_like(close, np.nan)
 
-FII Net Flow: Not Available
-DII Net Flow: Not Available
-"""
+        stats["vol_20d"] = np.nanstd(recent, axis=0, ddof=1) * np.sqrt(252) * 100
+        stats["drawdown"] = (close / np.nanmax(sessions, axis=0) - 1) * 100
+        stats["zscore"] = (
+            (daily[-1] - np.nanmean(baseline, axis=0))
+            / np.nanstd(baseline, axis=0, ddof=1)
+        )
 
-print("----- DEBUG FLOWS -----")
-print(fii_dii_data)
-print("-----------------------")
-fii_date_match = re.search(r"Date:\s*([^\n]+)", fii_dii_data)
-
-if fii_date_match:
-    fii_date = fii_date_match.group(1).strip()
-else:
-    fii_date = "Unknown"
-
-print("MARKET DATE:", trade_date)
-print("FII DATE:", fii_date)
-if trade_date not in fii_date:
-    print("WARNING: MARKET DATE AND FII DATE DO NOT MATCH")
-fii_match = re.search(r"FII Net Flow: ₹([-\d,.]+)", fii_dii_data)
-dii_match = re.search(r"DII Net Flow: ₹([-\d,.]+)", fii_dii_data)
-
-if fii_match:
-    fii_value = float(fii_match.group(1).replace(",", ""))
-else:
-    fii_value = 0
-
-if dii_match:
-    dii_value = float(dii_match.group(1).replace(",", ""))
-else:
-    dii_value = 0
-
-print("FII VALUE:", fii_value)
-print("DII VALUE:", dii_value)
-# ---------------- ANALYSIS INPUT ----------------
-analysis_input = f"""
-You are a professional equity market strategist writing a concise daily market brief.
+    return pd.DataFrame(stats, index=closes.columns)
 
-Your goal is to explain **what happened, why it happened, and what investors should understand**.
 
-Use the information below but you may **interpret relationships between market data and news logically**.
+def classify_regime(pct_changes):
 
-Avoid generic statements. Focus on **drivers and context**.
+    max_move = np.nanmax(np.abs(np.asarray(pct_changes, dtype=float)))
 
-If FII/DII flows are not available, explicitly state that they were not reported and avoid inferring institutional behaviour.
+    if max_move < 0.5:
+        return "Low Volatility Session"
+    elif max_move < 1:
+        return "Moderate Volatility Session"
 
-REPORT DATE:
-{today}
+    return "High Volatility Session"
 
-MARKET SESSION DATE:
-{trade_date}
 
-DOMESTIC MARKET DATA:
-{market_data}
+# ---------------- SNAPSHOTS ----------------
+# Typed records for what the market, global and flow fetchers return.
+# They travel through the run (and into the sheet) as data; text is
+# rendered from them only when the prompt or a sheet cell is built.
+@dataclass(slots=True)
+class Quote:
+    name: str
+    close: float
+    points: float
+    pct: float
+    ret_5d: float = None
+    ret_20d: float = None
+    vol_20d: float = None
+    drawdown: float = None
+    zscore: float = None
 
-GLOBAL MARKET DATA:
-{global_data}
+    @classmethod
+    def from_stats(cls, name, row):
 
-RECENT MARKET HISTORY:
-{historical_data}
+        # NaN becomes None so the record serializes as plain JSON
+        def value(key):
+            number = float(row[key])
+            return None if math.isnan(number) else round(number, 4)
 
-INSTITUTIONAL FLOWS:
-{fii_dii_data}
+        return cls(name, *(value(field.name) for field in fields(cls)[1:]))
 
-MARKET NEWS (full articles):
-{news_data}
+    def render(self, compact=False):
 
-Write a professional research-style brief using this structure:
-MARKET ANALYSIS RULES
+        label = QUOTE_LABELS[self.name]
 
-When identifying catalysts, use the following priority:
+        if compact:
+            return f"{label}: {self.close:.2f} ({self.pct:+.2f}%)"
 
-1. Market price action
-2. FII/DII flows
-3. India VIX
-4. Crude oil
-5. USD/INR
-6. Bond yields
-7. Historical trend data
-8. News articles
+        line = f"{label}: {self.close:.2f} ({self.points:+.2f}, {self.pct:.2f}%)"
 
-Do not assume a news article caused market movement.
+        extras = []
 
-News should only be cited as a catalyst if there is a clear and direct connection between the observed market behaviour.
+        for window in RETURN_WINDOWS:
+            ret = getattr(self, f"ret_{window}d")
+            if ret is not None:
+                extras.append(f"{window}D {ret:+.2f}%")
 
-If market data and news conflict, prioritise market data.
+        if self.vol_20d is not None:
+            extras.append(f"20D vol {self.vol_20d:.1f}%")
 
-Institutional flows, volatility indicators, crude oil and currency movements should generally be given more weight than individual corporate or regulatory news items.
+        if self.drawdown is not None:
+            extras.append(f"off high {self.drawdown:.2f}%")
 
-MARKET OVERVIEW
-Summarize the overall session in India. Mention index performance and volatility.
+        if self.zscore is not None:
+            extras.append(f"z {self.zscore:+.1f}")
 
-KEY CATALYSTS
-Identify the most likely drivers based on the news and data provided.
+        if extras:
+            line += " | " + ", ".join(extras)
 
-SECTOR / MARKET IMPACT
-Explain which parts of the market appear most affected.
+        return line
 
-GLOBAL CONTEXT & RISK INDICATORS
 
-Discuss the following indicators and what they imply:
+def quotes_from_stats(stats, symbols):
+    return [Quote.from_stats(name, stats.loc[symbol]) for name, symbol in symbols.items()]
 
-• S&P 500
-• NASDAQ
-• DOW JONES
-• USD/INR
-• Brent Crude
-• India VIX
-• US 10Y Treasury Yield
-• Gold
-• Silver
 
-Explain what they suggest about:
+def render_quotes(quotes, compact=False):
+    return "\n        ".join(quote.render(compact) for quote in quotes)
 
-- Global risk appetite
-- Market volatility
-- Inflation expectations
-- Safe-haven demand
-- Investor positioning
 
-Explain how VIX, crude oil, USD/INR, bond yields, gold and silver influence risk sentiment.
+def find_quote(quotes, name):
+    return next((quote for quote in quotes if quote.name == name), None)
 
-Do not merely repeat the numbers.
-Interpret their significance.
 
-INSTITUTIONAL FLOWS
-Explain how FII/DII flows align or diverge with the market move.
+@dataclass(slots=True)
+class MarketSnapshot:
+    trade_date: str
+    regime: str
+    quotes: list
 
-INVESTOR TAKEAWAY
-Compare today's session with the recent market history.
+    def close(self, name):
+        return round(find_quote(self.quotes, name).close, 2)
 
-Discuss:
+    def render(self, compact=False):
 
-• Whether today's move is part of an ongoing trend
-• Whether institutional behaviour is changing
-• Whether volatility is rising or falling
-• Whether risk appetite is improving or deteriorating
+        if compact:
+            return f"{self.regime}\n" + render_quotes(self.quotes, compact=True).replace("\n        ", "\n")
 
-Avoid discussing today's data in isolation.
+        return f"""
+        Trade Date: {self.trade_date}
+        Session Type: {self.regime}
 
+        {render_quotes(self.quotes)}
+        """
 
-Style guidelines:
 
+@dataclass(slots=True)
+class GlobalSnapshot:
+    quotes: list
 
-• Write like a professional research desk note
-• Avoid generic commentary
-• Be analytical but concise
-• Do NOT give predictions or buy/sell calls
-• Use clear financial language
+    def close(self, name):
+        return round(find_quote(self.quotes, name).close, 2)
 
-• When India VIX is available:
-  Explain whether volatility expectations are rising or falling.
+    def render(self, compact=False):
 
-• When US 10Y Treasury Yield is available:
-  Explain what it may indicate about global interest-rate expectations and liquidity conditions.
+        if compact:
+            return render_quotes(self.quotes, compact=True).replace("\n        ", "\n")
 
-• When Gold and Silver are available:
-  Discuss whether price action suggests risk-on or risk-off sentiment.
+        return f"""
+        {render_quotes(self.quotes)}
+        """
 
-• When Brent Crude is available:
-  Explain the implications for India as a major oil importer.
 
-• Distinguish facts from interpretations.
+@dataclass(slots=True)
+class FlowSnapshot:
+    date: str = None
+    fii: float = None
+    dii: float = None
+    error: str = None
 
-• Do not attribute market movements to a single headline unless strongly supported by market data. 
+    def render(self, compact=False):
+
+        def flow(value):
+            return "Not Available" if value is None else f"₹{value:,.2f} Cr"
+
+        if compact:
+            return f"FII {flow(self.fii)}, DII {flow(self.dii)}"
+
+        return f"""
+Source: NSE
+
+Date: {self.date or "Unknown"}
+FII Net Flow: {flow(self.fii)}
+DII Net Flow: {flow(self.dii)}
 """
 
-def generate_ai_brief(text):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a professional equity market analyst."},
-            {"role": "user", "content": text}
-        ],
-        temperature=0.25,
-        max_tokens=650
-    )
-    return response.choices[0].message.content
-    
-# ---------------- RUN AI ANALYSIS ----------------
 
-ai_output = generate_ai_brief(analysis_input)
+SNAPSHOT_TYPES = {
+    cls.__name__: cls
+    for cls in (Quote, MarketSnapshot, GlobalSnapshot, FlowSnapshot)
+}
 
-print("===================================")
-print("DAILY MARKET BRIEF – AI")
-print("DATE:", today)
-print("===================================")
-print(ai_output)
 
-def update_Indicator_history():
+def encode_snapshot(obj):
+
+    # json default hook: each record becomes a flat dict tagged with its
+    # type, so nested quotes survive the round trip
+    if type(obj).__name__ in SNAPSHOT_TYPES:
+        return {
+            "_type": type(obj).__name__,
+            **{field.name: getattr(obj, field.name) for field in fields(obj)}
+        }
 
-    creds_json = os.getenv("GOOGLE_SERVICE_ACCOUNT")
-    creds_dict = json.loads(creds_json)
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
 
-    scopes = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
 
-    creds = Credentials.from_service_account_info(
-        creds_dict,
-        scopes=scopes
-    )
+def decode_snapshot(data):
 
-    client = gspread.authorize(creds)
+    # json object_hook, the inverse of encode_snapshot
+    cls = SNAPSHOT_TYPES.get(data.get("_type"))
 
-    spreadsheet = client.open_by_key(
-        "1vSuZmhAYVgBhTz4nx9g_fZnmV2ulEUJwisjIWfoQK64"
-    )
+    if cls is None:
+        return data
 
-    sheet = spreadsheet.worksheet("Indicator_History")
-    all_rows = sheet.get_all_values()
+    return cls(**{key: value for key, value in data.items() if key != "_type"})
 
-    print("Rows in Indicator_History:", len(all_rows))
 
-    row_to_update = None
+def dump_snapshots(obj):
+    return json.dumps(obj, default=encode_snapshot, separators=(",", ":"), ensure_ascii=False)
 
-    for idx, row in enumerate(all_rows, start=1):
 
-        if len(row) > 0 and row[0] == trade_date:
-            row_to_update = idx
-            break
+def load_snapshots(text):
+    return json.loads(text, object_hook=decode_snapshot)
 
-    print("Indicator Row:", row_to_update)
-
-    new_row = [
-        trade_date,
-        nifty_value,
-        bank_nifty_value,
-        sensex_value,
-        fii_value,
-        dii_value,
-        vix_value,
-        brent_value,
-        usdinr_value,
-        us10y_value,
-        gold_value,
-        silver_value
-    ]
 
-    if row_to_update:
+def render_snapshot(value, compact=False):
 
-        sheet.update(
-            f"A{row_to_update}:L{row_to_update}",
-            [new_row]
-        )
+    # Snapshots render themselves; anything else is already text (old
+    # sheet rows, fallbacks)
+    if value is None:
+        return "Unavailable."
 
-        print("Updated Indicator Row")
+    if hasattr(value, "render"):
+        return value.render(compact)
 
-    else:
+    return value
 
-        sheet.append_row(
-            new_row,
-            value_input_option="RAW"
+
+# ---------------- FETCH LIVE MARKET DATA ----------------
+def fetch_market_data():
+
+    # MarketSnapshot, or None when the session can't be priced
+    try:
+        panel = fetch_quote_panel()
+        stats = compute_indicators(panel)
+
+        india = stats.loc[list(INDIA_SYMBOLS.values())]
+
+        if india["prev"].isna().any():
+            return None
+
+        return MarketSnapshot(
+            trade_date=panel[INDIA_SYMBOLS["nifty"]].last_valid_index().strftime("%d %b %Y"),
+            regime=classify_regime(india["pct"]),
+            quotes=quotes_from_stats(stats, INDIA_SYMBOLS)
         )
 
-        print("Added Indicator Row")
+    except Exception:
+        return None
 
-# ---------------- WRITE TO GOOGLE SHEETS ----------------
-def update_google_sheet(date, market_data, global_data, flows, news, brief):
 
-    creds_json = os.getenv("GOOGLE_SERVICE_ACCOUNT")
+# ---------------- FETCH GLOBAL MARKET DATA ----------------
+def fetch_global_data():
 
-    if not creds_json:
-        raise Exception("GOOGLE_SERVICE_ACCOUNT secret not found.")
+    # GlobalSnapshot, or None when any market lacks a previous close
+    try:
+        panel = fetch_quote_panel()
+        stats = compute_indicators(panel)
 
-    creds_dict = json.loads(creds_json)
+        if stats.loc[list(GLOBAL_SYMBOLS.values()), "prev"].isna().any():
+            raise ValueError("Not enough global history")
 
-    scopes = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
+        return GlobalSnapshot(quotes=quotes_from_stats(stats, GLOBAL_SYMBOLS))
 
-    creds = Credentials.from_service_account_info(
-        creds_dict,
-        scopes=scopes
-    )
+    except Exception:
+        return None
 
-    client = gspread.authorize(creds)
 
-    sheet = client.open_by_key(
-        "1vSuZmhAYVgBhTz4nx9g_fZnmV2ulEUJwisjIWfoQK64"
-    ).sheet1
+# ---------------- SECTOR BREADTH ----------------
+SECTOR_SYMBOLS = {
+    "IT": "^CNXIT",
+    "Auto": "^CNXAUTO",
+    "FMCG": "^CNXFMCG",
+    "Pharma": "^CNXPHARMA",
+    "Metal": "^CNXMETAL",
+    "Realty": "^CNXREALTY",
+    "Energy": "^CNXENERGY",
+    "PSU Bank": "^CNXPSUBANK",
+    "Media": "^CNXMEDIA",
+    "Infra": "^CNXINFRA",
+    "Fin Services": "NIFTY_FIN_SERVICE.NS"
+}
 
-    # Check whether today's date already exists
+NIFTY50_LIST_URL = "https://niftyindices.com/IndexConstituent/ind_nifty50list.csv"
+CONSTITUENTS_PATH = os.path.join(CACHE_DIR, "nifty50_constituents.json")
+CONSTITUENTS_TTL_DAYS = float(os.getenv("CONSTITUENTS_TTL_DAYS", "7"))
 
-    all_rows = sheet.get_all_values()
+BREADTH_TOP_MOVERS = 3
 
-    row_to_update = None
+_constituents = None
 
-    for idx, row in enumerate(all_rows, start=1):
 
-        if len(row) > 0 and row[0] == date:
-            row_to_update = idx
-            break
+def get_nifty50_constituents():
 
-    print("Existing Row:", row_to_update)
+    # [{"symbol": ..., "industry": ...}], refreshed weekly from the
+    # published index list. A stale copy beats no copy if NSE is down.
+    import pandas as pd
 
-    new_data = [
-        date,
-        market_data,
-        global_data,
-        flows,
-        news,
-        brief
-    ]
+    global _constituents
 
-    if row_to_update:
+    if _constituents is not None:
+        return _constituents
 
-        sheet.update(
-            f"A{row_to_update}:F{row_to_update}",
-            [new_data]
-        )
+    cached = None
+
+    try:
+        with open(CONSTITUENTS_PATH) as f:
+            cached = json.load(f)
 
-        print(f"Updated existing row for {date}")
+        if time.time() - cached["fetched_at"] < CONSTITUENTS_TTL_DAYS * 86400:
+            _constituents = cached["constituents"]
+            return _constituents
 
-    else:
+    except (OSError, ValueError, KeyError):
+        pass
 
-        sheet.append_row(
-            new_data,
-            value_input_option="RAW"
-        )
+    try:
+        with timed("nse.constituents"):
+
+            r = http_get(NIFTY50_LIST_URL)
+
+        r.raise_for_status()
+
+        df = pd.read_csv(StringIO(r.text))
+
+        _constituents = [
+            {"symbol": row["Symbol"].strip(), "industry": row["Industry"].strip()}
+            for _, row in df.iterrows()
+        ]
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        with open(CONSTITUENTS_PATH, "w") as f:
+            json.dump({"fetched_at": time.time(), "constituents": _constituents}, f)
+
+    except Exception as e:
+
+        print("CONSTITUENTS UNAVAILABLE:", e)
+
+        _constituents = cached["constituents"] if cached else []
+
+    return _constituents
+
+
+def constituent_symbols():
+    return [item["symbol"] + ".NS" for item in get_nifty50_constituents()]
+
+
+def fetch_sector_breadth():
+    try:
+        panel = fetch_quote_panel()
+        stats = compute_indicators(panel)
+
+        sectors = stats.loc[list(SECTOR_SYMBOLS.values()), ["pct", "ret_5d"]]
+        sectors.index = list(SECTOR_SYMBOLS.keys())
+        sectors = sectors.dropna(subset=["pct"]).sort_values("pct", ascending=False)
+
+        lines = ["SECTORS (1D / 5D):"]
+
+        for name, row in sectors.iterrows():
+
+            # Fewer than six closes leaves no 5-day return
+            ret_5d = "n/a" if math.isnan(row["ret_5d"]) else f"{row['ret_5d']:+.2f}%"
+
+            lines.append(f"  {name}: {row['pct']:+.2f}% / {ret_5d}")
+
+        stocks = stats.loc[constituent_symbols(), "pct"].dropna()
+
+        if len(stocks):
+
+            advances = int((stocks > 0).sum())
+            declines = int((stocks < 0).sum())
+            unchanged = len(stocks) - advances - declines
+
+            ad_ratio = f"{advances / declines:.2f}" if declines else "n/a"
+
+            def movers(series):
+                return ", ".join(
+                    f"{symbol.removesuffix('.NS')} {pct:+.2f}%"
+                    for symbol, pct in series.items()
+                ) or "none"
+
+            lines.append(
+                f"NIFTY 50 BREADTH: {advances} advances, {declines} declines, "
+                f"{unchanged} unchanged (A/D {ad_ratio})"
+            )
+            lines.append("TOP GAINERS: " + movers(stocks[stocks > 0].nlargest(BREADTH_TOP_MOVERS)))
+            lines.append("TOP LOSERS: " + movers(stocks[stocks < 0].nsmallest(BREADTH_TOP_MOVERS)))
+
+        if len(lines) == 1:
+            return "Sector data unavailable."
+
+        return "\n".join(lines)
+
+    except Exception:
+        return "Sector data unavailable."
+# ---------------- FETCH FII / DII DATA FROM NSE ----------------
+NSE_HOME_URL = "https://www.nseindia.com"
+NSE_FII_DII_URL = "https://www.nseindia.com/api/fiidiiTradeNse?csv=true"
+NSE_HEADERS = {"Referer": "https://www.nseindia.com/reports/fii-dii"}
+
+
+def nse_get(url):
+
+    # Reuses the session cookies from one warm-up per run; a 401/403
+    # means they expired, so warm up again and retry once
+    warm_up(NSE_HOME_URL, headers=NSE_HEADERS)
+
+    response = http_get(url, headers=NSE_HEADERS)
+
+    if response.status_code in (401, 403):
+        warm_up(NSE_HOME_URL, headers=NSE_HEADERS, force=True)
+        response = http_get(url, headers=NSE_HEADERS)
+
+    return response
+
+
+@timed("nse.fii_dii")
+def fetch_fii_dii_data():
+
+    try:
+
+        response = nse_get(NSE_FII_DII_URL)
+
+        response.raise_for_status()
+
+        lines = response.text.splitlines()
+
+        dii_line = None
+        fii_line = None
+
+        for line in lines:
+
+            if '"DII"' in line:
+                dii_line = line
+
+            if '"FII/FPI"' in line:
+                fii_line = line
+
+        if not dii_line or not fii_line:
+            raise Exception("Could not locate DII/FII rows")
+
+        dii_parts = [x.strip('"') for x in dii_line.split('","')]
+        fii_parts = [x.strip('"') for x in fii_line.split('","')]
+
+        # NSE reports 16-Oct-2026; the rest of the run uses 16 Oct 2026
+        date = datetime.datetime.strptime(fii_parts[1], "%d-%b-%Y").strftime("%d %b %Y")
+
+        return FlowSnapshot(
+            date=date,
+            fii=float(fii_parts[4].replace(",", "")),
+            dii=float(dii_parts[4].replace(",", ""))
+        )
+
+    except Exception as e:
+        return FlowSnapshot(error=str(e))
+# ---------------- FETCH LIVE NEWS ----------------
+
+# ---------------- ARTICLE CACHE ----------------
+ARTICLE_CACHE_PATH = os.path.join(CACHE_DIR, "articles.sqlite")
+ARTICLE_CACHE_TTL_HOURS = float(os.getenv("ARTICLE_CACHE_TTL_HOURS", "72"))
+ARTICLE_CACHE_MAX_ENTRIES = int(os.getenv("ARTICLE_CACHE_MAX_ENTRIES", "500"))
+
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid")
+
+_article_cache_conn = None
+_article_cache_lock = threading.Lock()
+
+
+def normalize_url(url):
+
+    parts = urlsplit(url.strip())
+
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    )
+
+    path = parts.path
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    return urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        path,
+        urlencode(query),
+        ""
+    ))
+
+
+def get_article_cache():
+
+    global _article_cache_conn
+
+    if _article_cache_conn is None:
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        _article_cache_conn = sqlite3.connect(
+            ARTICLE_CACHE_PATH,
+            check_same_thread=False
+        )
+
+        _article_cache_conn.execute("""
+            CREATE TABLE IF NOT EXISTS articles (
+                url TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+
+    return _article_cache_conn
+
+
+def article_cache_get(url):
+
+    # Returns the cached entry (fresh or stale) or None. Stale entries
+    # are still useful for a conditional request.
+    try:
+        with _article_cache_lock:
+
+            conn = get_article_cache()
+            key = normalize_url(url)
+
+            row = conn.execute(
+                "SELECT text, etag, last_modified, fetched_at FROM articles WHERE url = ?",
+                (key,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            now = time.time()
+
+            conn.execute(
+                "UPDATE articles SET accessed_at = ? WHERE url = ?",
+                (now, key)
+            )
+            conn.commit()
+
+        text, etag, last_modified, fetched_at = row
+
+        return {
+            "text": text,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fresh": now - fetched_at < ARTICLE_CACHE_TTL_HOURS * 3600
+        }
+
+    except sqlite3.Error as e:
+        print("ARTICLE CACHE ERROR:", e)
+        return None
+
+
+def article_cache_put(url, text, etag=None, last_modified=None):
+
+    try:
+        with _article_cache_lock:
+
+            conn = get_article_cache()
+            now = time.time()
+
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO articles
+                    (url, text, etag, last_modified, fetched_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (normalize_url(url), text, etag, last_modified, now, now)
+            )
+
+            # LRU eviction down to the size bound
+            conn.execute(
+                """
+                DELETE FROM articles WHERE url IN (
+                    SELECT url FROM articles
+                    ORDER BY accessed_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (ARTICLE_CACHE_MAX_ENTRIES,)
+            )
+
+            conn.commit()
+
+    except sqlite3.Error as e:
+        print("ARTICLE CACHE ERROR:", e)
+
+
+# ---------------- FAST EXTRACTION ----------------
+# Streams the downloaded HTML through lxml's pull parser and keeps the
+# paragraph text of the publisher's article body, stopping as soon as
+# ARTICLE_TEXT_LIMIT characters are in hand. newspaper is only run when
+# this finds too little text.
+ARTICLE_TEXT_LIMIT = 3000
+ARTICLE_MIN_CHARS = int(os.getenv("ARTICLE_MIN_CHARS", "200"))
+ARTICLE_PARSE_CHUNK = 16384
+
+# Article body container per publisher: (attribute, value); class
+# matches any one of the element's classes
+ARTICLE_SELECTORS = {
+    "www.thehindubusinessline.com": ("class", "articlebodycontent"),
+    "economictimes.indiatimes.com": ("class", "artText"),
+    "www.moneycontrol.com": ("id", "contentdata")
+}
+
+ARTICLE_SKIP_TAGS = {
+    "script", "style", "noscript", "template", "figure", "figcaption",
+    "aside", "nav", "header", "footer", "form", "button", "svg"
+}
+
+
+def matches_selector(element, selector):
+
+    attribute, value = selector
+
+    if attribute == "class":
+        return value in (element.get("class") or "").split()
+
+    return element.get(attribute) == value
+
+
+# Elements that start a new line when a container's own text is read
+ARTICLE_BLOCK_TAGS = {
+    "br", "div", "p", "section", "li", "h2", "h3", "h4", "blockquote", "tr"
+}
+
+
+def container_text(container):
+
+    # The container's own text, one line per <br> or block element, for
+    # layouts that do not wrap the article in <p>
+    lines, current = [], []
+
+    def flush():
+        line = " ".join("".join(current).split())
+        if line:
+            lines.append(line)
+        current.clear()
+
+    def walk(element):
+
+        tag = element.tag if isinstance(element.tag, str) else None
+
+        # Comments and skipped subtrees add nothing; their tail is read
+        # by the parent
+        if tag is None or tag in ARTICLE_SKIP_TAGS:
+            return
+
+        if tag in ARTICLE_BLOCK_TAGS:
+            flush()
+
+        if element.text:
+            current.append(element.text)
+
+        for child in element:
+
+            walk(child)
+
+            if child.tail:
+                current.append(child.tail)
+
+        if tag in ARTICLE_BLOCK_TAGS:
+            flush()
+
+    walk(container)
+    flush()
+
+    return lines
+
+
+def fast_extract_text(html, url, encoding=None, limit=ARTICLE_TEXT_LIMIT):
+
+    # html: bytes or str. For hosts with a selector, the paragraphs
+    # inside the publisher's container, or its own text when it has no
+    # <p>; empty when the page lacks the container, so the caller falls
+    # back to newspaper. Other hosts: every paragraph outside
+    # navigation, scripts and the like.
+    from lxml import etree
+
+    selector = ARTICLE_SELECTORS.get(urlsplit(url).hostname)
+
+    parser = etree.HTMLPullParser(events=("start", "end"), encoding=encoding)
+
+    body, body_chars = [], 0
+    loose, loose_chars = [], 0
+
+    container = None
+    container_done = False
+    skip_depth = 0
+    paragraph_depth = 0
+
+    for offset in range(0, len(html), ARTICLE_PARSE_CHUNK):
+
+        parser.feed(html[offset:offset + ARTICLE_PARSE_CHUNK])
+
+        for event, element in parser.read_events():
+
+            tag = element.tag if isinstance(element.tag, str) else ""
+
+            if event == "start":
+
+                if tag in ARTICLE_SKIP_TAGS:
+                    skip_depth += 1
+                elif tag == "p":
+                    paragraph_depth += 1
+
+                if selector and container is None and not container_done \
+                        and matches_selector(element, selector):
+                    container = element
+
+                continue
+
+            if tag in ARTICLE_SKIP_TAGS:
+                skip_depth -= 1
+
+            elif tag == "p":
+
+                paragraph_depth -= 1
+
+                if not skip_depth:
+
+                    text = " ".join(" ".join(element.itertext()).split())
+
+                    if text and container is not None:
+                        body.append(text)
+                        body_chars += len(text) + 1
+
+                    elif text and not selector and loose_chars < limit:
+                        loose.append(text)
+                        loose_chars += len(text) + 1
+
+            if element is container:
+
+                if not body:
+                    body = container_text(container)
+
+                container = None
+                container_done = True
+
+            # Inline children are read with their paragraph, and the
+            # container is kept whole until it closes, so only drop
+            # subtrees outside both
+            if not paragraph_depth and container is None:
+                element.clear()
+
+        if body_chars >= limit or container_done or (not selector and loose_chars >= limit):
+            break
+
+    parts = body if selector else loose
+
+    return "\n".join(parts)[:limit]
+
+
+@timed("article.extract")
+def extract_article_text(url):
+
+    try:
+        cached = article_cache_get(url)
+
+        if cached and cached["fresh"]:
+            count("article_cache_hits")
+            return cached["text"]
+
+        count("article_cache_misses")
+
+        headers = {}
+
+        if cached:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        r = http_get(url, headers=headers)
+
+        if r.status_code == 304 and cached:
+            count("article_cache_revalidated")
+            article_cache_put(url, cached["text"], cached["etag"], cached["last_modified"])
+            return cached["text"]
+
+        r.raise_for_status()
+
+        # Charset from the headers if they give one, else lxml reads
+        # the page's own meta tag
+        encoding = r.encoding if "charset" in r.headers.get("Content-Type", "").lower() else None
+
+        text = fast_extract_text(r.content, url, encoding)
+
+        if len(text) >= ARTICLE_MIN_CHARS:
+            count("article_fast_path")
+
+        else:
+
+            # Unknown layout: newspaper on the page we already
+            # downloaded instead of letting it fetch again
+            from newspaper import Article
+
+            count("article_fallbacks")
+
+            article = Article(url)
+            article.download(input_html=r.text)
+            article.parse()
+
+            text = (article.text or text)[:ARTICLE_TEXT_LIMIT]
+
+        if text:
+            article_cache_put(
+                url,
+                text,
+                r.headers.get("ETag"),
+                r.headers.get("Last-Modified")
+            )
+
+        return text
+
+    except Exception:
+        return ""
+
+
+# ---------------- CONCURRENT EXTRACTION ----------------
+NEWS_MAX_WORKERS = int(os.getenv("NEWS_MAX_WORKERS", "8"))
+NEWS_PER_HOST_LIMIT = int(os.getenv("NEWS_PER_HOST_LIMIT", "3"))
+NEWS_DEADLINE_SECONDS = float(os.getenv("NEWS_DEADLINE_SECONDS", "30"))
+
+
+def extract_articles(links,
+                     max_workers=NEWS_MAX_WORKERS,
+                     per_host=NEWS_PER_HOST_LIMIT,
+                     deadline=NEWS_DEADLINE_SECONDS):
+
+    # Returns article texts in the same order as links. Anything still
+    # running when the deadline passes comes back as "" so the caller
+    # falls back to the RSS summary.
+    if not links:
+        return []
+
+    host_limits = {
+        urlparse(link).netloc: threading.Semaphore(per_host)
+        for link in links
+    }
+
+    def worker(link):
+        with host_limits[urlparse(link).netloc]:
+            return extract_article_text(link)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    futures = [executor.submit(worker, link) for link in links]
+
+    done, not_done = wait(futures, timeout=deadline)
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    if not_done:
+        print(f"NEWS DEADLINE HIT: {len(not_done)} of {len(futures)} articles skipped")
+
+    return [
+        future.result() if future in done else ""
+        for future in futures
+    ]
+
+
+# ---------------- NEWS RELEVANCE ----------------
+NEWS_SOURCES = [
+    "https://www.thehindubusinessline.com/markets/feeder/default.rss",
+    "https://economictimes.indiatimes.com/markets/rssfeeds/1977021501.cms",
+    "https://www.moneycontrol.com/rss/business.xml"
+]
+
+# Feeds for the panel briefs, which cover markets outside India
+US_NEWS_SOURCES = [
+    "https://feeds.content.dowjones.io/public/rss/mw_topstories",
+    "https://feeds.content.dowjones.io/public/rss/mw_marketpulse"
+]
+
+COMMODITY_NEWS_SOURCES = [
+    "https://www.investing.com/rss/news_11.rss",
+    "https://www.thehindubusinessline.com/markets/commodities/feeder/default.rss"
+]
+
+FX_NEWS_SOURCES = [
+    "https://www.investing.com/rss/news_1.rss",
+    "https://www.thehindubusinessline.com/markets/forex/feeder/default.rss"
+]
+
+# Whole words or phrases; a trailing "*" marks a deliberate stem
+# ("fii*" also matches "FIIs")
+MARKET_KEYWORDS = [
+    "nifty*",
+    "sensex*",
+    "fii*",
+    "dii*",
+    "rbi",
+    "inflation*",
+    "fed",
+    "federal reserve",
+    "crude",
+    "oil*",
+    "rupee*",
+    "economy",
+    "gdp",
+    "treasury yield*",
+    "bond yield*"
+]
+
+
+def keyword_pattern(keywords):
+
+    # Single alternation over every keyword, anchored on word edges so
+    # "dow" does not match "down". Lookarounds rather than \b, since
+    # keywords like "s&p" do not end in a word character.
+    alternatives = [
+        re.escape(keyword[:-1]) + r"\w*" if keyword.endswith("*") else re.escape(keyword)
+        for keyword in keywords
+    ]
+
+    return re.compile(
+        r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)",
+        re.IGNORECASE
+    )
+
+
+MARKET_KEYWORDS_RE = keyword_pattern(MARKET_KEYWORDS)
+
+# RSS summaries shorter than this are too thin to reject an entry on,
+# so those entries are fetched anyway and judged on the full text.
+NEWS_UNCERTAIN_SUMMARY_CHARS = int(os.getenv("NEWS_UNCERTAIN_SUMMARY_CHARS", "80"))
+
+
+def is_market_relevant(text, keywords_re=MARKET_KEYWORDS_RE):
+    return keywords_re.search(text) is not None
+
+
+def entry_summary(entry):
+
+    # entry is a raw feedparser entry
+    if hasattr(entry, "summary"):
+        return entry.summary
+    elif hasattr(entry, "description"):
+        return entry.description
+
+    return ""
+
+
+def prefilter_entry(entry, keywords_re=MARKET_KEYWORDS_RE):
+
+    # Stage one: decide from the feed metadata alone.
+    # Returns "keep", "uncertain" or "reject".
+    title = entry["title"]
+    summary = re.sub('<.*?>', '', entry["summary"])
+
+    if is_market_relevant(title + " " + summary, keywords_re):
+        return "keep"
+
+    if len(summary.strip()) < NEWS_UNCERTAIN_SUMMARY_CHARS:
+        return "uncertain"
+
+    return "reject"
+
+
+# ---------------- NEAR-DUPLICATE DETECTION ----------------
+# Word shingles + MinHash, bucketed with LSH so only articles sharing a
+# band are ever compared. 16 bands of 4 rows puts the LSH threshold
+# near a Jaccard similarity of 0.5.
+SHINGLE_SIZE = 3
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.5"))
+
+# a * h stays below 2**62 with a, h < 2**31, so uint64 never overflows
+_MINHASH_PRIME = (1 << 31) - 1
+_minhash_rng = np.random.default_rng(20240601)
+_MINHASH_A = _minhash_rng.integers(1, _MINHASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _minhash_rng.integers(0, _MINHASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def shingles(text):
+
+    words = re.findall(r"[a-z0-9]+", text.lower())
+
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+
+    return {
+        " ".join(words[i:i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash_signature(shingle_set):
+
+    if not shingle_set:
+        return np.full(MINHASH_PERMUTATIONS, _MINHASH_PRIME, dtype=np.uint64)
+
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode()) % _MINHASH_PRIME for shingle in shingle_set),
+        dtype=np.uint64,
+        count=len(shingle_set)
+    )
+
+    return ((np.outer(_MINHASH_A, hashes) + _MINHASH_B[:, None]) % _MINHASH_PRIME).min(axis=1)
+
+
+def cluster_near_duplicates(articles, threshold=NEAR_DUPLICATE_THRESHOLD):
+
+    # Returns clusters as lists of article indices, each in input order,
+    # ordered by their first member
+    signatures = [
+        minhash_signature(shingles(article["title"] + " " + article["text"]))
+        for article in articles
+    ]
+
+    parent = list(range(len(articles)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        parent[max(find(i), find(j))] = min(find(i), find(j))
+
+    rows_per_band = MINHASH_PERMUTATIONS // LSH_BANDS
+    buckets = {}
+
+    for i, signature in enumerate(signatures):
+
+        for band in range(LSH_BANDS):
+            key = (band, signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes())
+            buckets.setdefault(key, []).append(i)
+
+        # identical headlines are always the same story
+        buckets.setdefault(("title", articles[i]["title"].lower()), []).append(i)
+
+    for key, members in buckets.items():
+
+        for pos, j in enumerate(members):
+            for i in members[:pos]:
+
+                if find(i) == find(j):
+                    continue
+
+                if key[0] == "title" or np.mean(signatures[i] == signatures[j]) >= threshold:
+                    union(i, j)
+
+    clusters = {}
+
+    for i in range(len(articles)):
+        clusters.setdefault(find(i), []).append(i)
+
+    return sorted(clusters.values(), key=lambda members: members[0])
+
+
+@timed("news.dedupe")
+def dedupe_articles(articles):
+
+    # One article per story: the member with the most text, in the slot
+    # of the cluster's earliest member
+    unique_articles = []
+
+    for members in cluster_near_duplicates(articles):
+
+        richest = max(members, key=lambda i: len(articles[i]["text"]))
+
+        if len(members) > 1:
+            print("NEAR DUPLICATES:", [articles[i]["title"] for i in members])
+
+        unique_articles.append(articles[richest])
+
+    return unique_articles
+
+
+# ---------------- FEED STATE ----------------
+FEED_STATE_PATH = os.path.join(CACHE_DIR, "feeds.json")
+
+
+def load_feed_state():
+
+    try:
+        with open(FEED_STATE_PATH) as f:
+            return json.load(f)
+
+    except (OSError, ValueError):
+        return {}
+
+
+def save_feed_state(state):
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        tmp_path = FEED_STATE_PATH + ".tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+
+        os.replace(tmp_path, FEED_STATE_PATH)
+
+    except OSError as e:
+        print("FEED STATE ERROR:", e)
+
+
+def fetch_feed_entries(url, state):
+
+    # Conditional fetch using the ETag/Last-Modified from the last run.
+    # Entries already seen carry their processed result ("text"/"kept")
+    # forward, so only new GUIDs go through the relevance pipeline.
+    import feedparser
+
+    feed_state = state.get(url, {})
+    previous_entries = feed_state.get("entries", [])
+
+    headers = {}
+
+    if feed_state.get("etag"):
+        headers["If-None-Match"] = feed_state["etag"]
+    if feed_state.get("modified"):
+        headers["If-Modified-Since"] = feed_state["modified"]
+
+    try:
+        with timed("rss.parse"):
+
+            # Fetched over the shared session rather than feedparser's
+            # own urllib connection
+            response = http_get(url, headers=headers)
+
+            if response.status_code == 304:
+                feed = None
+            else:
+                response.raise_for_status()
+                feed = feedparser.parse(
+                    response.content,
+                    response_headers={"content-type": response.headers.get("Content-Type", "")}
+                )
+
+    except Exception as e:
+        print("FEED ERROR:", url, e)
+        return previous_entries
+
+    if feed is None:
+        count("rss_not_modified")
+        print("FEED NOT MODIFIED:", url)
+        return previous_entries
+
+    if not feed.entries:
+        return previous_entries
+
+    seen = {entry["id"]: entry for entry in previous_entries}
+
+    entries = []
+
+    for entry in feed.entries[:6]:
+
+        guid = entry.get("id") or entry.link
+
+        if guid in seen:
+            entries.append(seen[guid])
+            continue
+
+        entries.append({
+            "id": guid,
+            "title": entry.title.strip(),
+            "link": entry.link,
+            "summary": entry_summary(entry)
+        })
+
+    state[url] = {
+        "etag": response.headers.get("ETag"),
+        "modified": response.headers.get("Last-Modified"),
+        "entries": entries
+    }
+
+    return entries
+
+
+def keywords_signature(keywords_re):
+    return hashlib.sha1(keywords_re.pattern.encode("utf-8")).hexdigest()[:12]
+
+
+def needs_processing(entry, signature):
+
+    # Verdicts only carry over when they were made with the same keywords
+    if "kept" not in entry or entry.get("keywords") != signature:
+        return True
+
+    # Retry candidates whose full text could not be fetched last time
+    return entry["verdict"] != "reject" and not entry["extracted"]
+
+
+def collect_market_articles(feeds=NEWS_SOURCES, keywords_re=MARKET_KEYWORDS_RE, dedupe=True):
+
+    # Relevant articles in feed order, de-duplicated unless the caller
+    # narrows the pool first (dedupe=False):
+    # [{"title": ..., "link": ..., "text": ..., "source": feed url}]
+    entries = []
+
+    feed_state = load_feed_state()
+    signature = keywords_signature(keywords_re)
+
+    for url in feeds:
+        for entry in fetch_feed_entries(url, feed_state):
+            entry["source"] = url
+            entries.append(entry)
+
+    pending = [entry for entry in entries if needs_processing(entry, signature)]
+    candidates = []
+
+    for entry in pending:
+
+        entry["keywords"] = signature
+        entry["verdict"] = prefilter_entry(entry, keywords_re)
+
+        print("TITLE:", entry["title"])
+        print("PREFILTER:", entry["verdict"])
+
+        if entry["verdict"] == "reject":
+            entry["text"] = ""
+            entry["extracted"] = False
+            entry["kept"] = False
+        else:
+            candidates.append(entry)
+
+    # Stage two: full text only for the entries that survived
+    texts = extract_articles([entry["link"] for entry in candidates])
+
+    for entry, article_text in zip(candidates, texts):
+
+        title = entry["title"]
+        
+        print("TITLE:", title)
+        print("LINK:", entry["link"])
+        print("ARTICLE LENGTH:", len(article_text))
+        print("==========================")
+
+        entry["extracted"] = bool(article_text)
+
+        # fallback if scraping fails
+        if not article_text:
+            article_text = entry["summary"]
+
+        article_text = re.sub('<.*?>', '', article_text)
+
+        entry["text"] = article_text
+        entry["kept"] = is_market_relevant(title + " " + article_text, keywords_re)
+
+    save_feed_state(feed_state)
+
+    all_articles = []
+
+    for entry in entries:
+
+        if entry["kept"]:
+
+            print("KEPT ARTICLE:", entry["title"])
+
+            all_articles.append({
+                "title": entry["title"],
+                "link": entry["link"],
+                "text": entry["text"],
+                "source": entry["source"]
+            })
+
+    if not dedupe:
+        return all_articles
+
+    return dedupe_articles(all_articles)
+
+
+def format_news(articles):
+
+    if not articles:
+        return "No relevant market news available."
+
+    return "\n\n".join(
+        f"""
+TITLE: {article["title"]}
+
+ARTICLE:
+{article["text"]}
+"""
+        for article in articles
+    )
+
+
+def fetch_market_news():
+    try:
+        return format_news(collect_market_articles()[:6])
+
+    except Exception:
+        return "News data unavailable."
+# ---------------- OPENAI ----------------
+LLM_CACHE_DIR = os.path.join(CACHE_DIR, "llm")
+LLM_CACHE_TTL_DAYS = float(os.getenv("LLM_CACHE_TTL_DAYS", "7"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "200"))
+
+# Set LLM_CACHE_BYPASS=1 to always call the API (the answer is still
+# written back to the cache)
+LLM_CACHE_BYPASS = os.getenv("LLM_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+OPENAI_API_HOST = "api.openai.com"
+
+# The client retries 429s and 5xx itself, honouring Retry-After
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+
+_openai_client = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_openai_client():
+
+    # Built on first use so cached runs need no API key at all
+    global _openai_client
+
+    if _openai_client is None:
+        from openai import OpenAI
+
+        _openai_client = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=OPENAI_MAX_RETRIES
+        )
+
+    return _openai_client
+
+
+def llm_cache_key(request):
+
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def llm_cache_get(key):
+
+    path = os.path.join(LLM_CACHE_DIR, key + ".json")
+
+    try:
+        if time.time() - os.path.getmtime(path) > LLM_CACHE_TTL_DAYS * 86400:
+            return None
+
+        with open(path) as f:
+            content = json.load(f)["content"]
+
+        # mtime doubles as the LRU clock
+        os.utime(path)
+
+        return content
+
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def llm_cache_put(key, request, content):
+
+    try:
+        with _llm_cache_lock:
+
+            os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+
+            path = os.path.join(LLM_CACHE_DIR, key + ".json")
+            tmp_path = path + ".tmp"
+
+            with open(tmp_path, "w") as f:
+                json.dump({"request": request, "content": content}, f)
+
+            os.replace(tmp_path, path)
+
+            entries = sorted(
+                (entry for entry in os.scandir(LLM_CACHE_DIR) if entry.name.endswith(".json")),
+                key=lambda entry: entry.stat().st_mtime
+            )
+
+            for entry in entries[:max(len(entries) - LLM_CACHE_MAX_ENTRIES, 0)]:
+                os.remove(entry.path)
+
+    except OSError as e:
+        print("LLM CACHE ERROR:", e)
+
+
+def chat_completion(model, messages, temperature, max_tokens):
+
+    # Content-addressed: the same (model, messages, temperature,
+    # max_tokens) returns the stored answer without an API call
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+
+    key = llm_cache_key(request)
+
+    if not LLM_CACHE_BYPASS:
+
+        cached = llm_cache_get(key)
+
+        if cached is not None:
+            count("llm_cache_hits")
+            print("LLM CACHE HIT:", key[:12])
+            return cached
+
+    rate_limiter(OPENAI_API_HOST).acquire()
+
+    with timed("openai.chat"):
+        response = get_openai_client().chat.completions.create(**request)
+
+    count("http_calls")
+    count("llm_cache_misses")
+
+    if response.usage:
+        count("llm_prompt_tokens", response.usage.prompt_tokens)
+        count("llm_completion_tokens", response.usage.completion_tokens)
+
+    content = response.choices[0].message.content
+
+    llm_cache_put(key, request, content)
+
+    return content
+
+
+def stream_chat_completion(model, messages, temperature, max_tokens, sinks):
+
+    # Same cache key as chat_completion, so streamed and blocking runs
+    # share entries. Chunks go to every sink as they arrive; the caller
+    # closes the sinks.
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+
+    key = llm_cache_key(request)
+    start = time.time()
+
+    if not LLM_CACHE_BYPASS:
+
+        cached = llm_cache_get(key)
+
+        if cached is not None:
+
+            count("llm_cache_hits")
+            print("LLM CACHE HIT:", key[:12])
+
+            for sink in sinks:
+                sink.write(cached)
+
+            return cached
+
+    rate_limiter(OPENAI_API_HOST).acquire()
+
+    stream = get_openai_client().chat.completions.create(
+        **request,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+    count("http_calls")
+    count("llm_cache_misses")
+
+    parts = []
+    first_token_at = None
+    prompt_tokens = None
+    completion_tokens = None
+
+    for chunk in stream:
+
+        if chunk.usage:
+            prompt_tokens = chunk.usage.prompt_tokens
+            completion_tokens = chunk.usage.completion_tokens
+
+        if not chunk.choices:
+            continue
+
+        delta = chunk.choices[0].delta.content
+
+        if not delta:
+            continue
+
+        if first_token_at is None:
+            first_token_at = time.time()
+
+        parts.append(delta)
+
+        for sink in sinks:
+            sink.write(delta)
+
+    end = time.time()
+    content = "".join(parts)
+
+    if completion_tokens is None:
+        completion_tokens = count_tokens(content)
+
+    if prompt_tokens is not None:
+        count("llm_prompt_tokens", prompt_tokens)
+
+    count("llm_completion_tokens", completion_tokens)
+    record_timing("openai.stream", end - start)
+
+    if first_token_at is not None:
+
+        generation_time = max(end - first_token_at, 1e-6)
+
+        record_timing("openai.first_token", first_token_at - start)
+
+        print(
+            f"LLM STREAM: first token {first_token_at - start:.2f}s, "
+            f"{completion_tokens} tokens in {end - start:.2f}s "
+            f"({completion_tokens / generation_time:.1f} tokens/s)"
+        )
+
+    llm_cache_put(key, request, content)
+
+    return content
+
+
+# ---------------- OUTPUT SINKS ----------------
+BRIEF_STREAM = os.getenv("BRIEF_STREAM", "").lower() in ("1", "true", "yes")
+BRIEF_OUTPUT_FILE = os.getenv("BRIEF_OUTPUT_FILE")
+# Other briefs are written to <BRIEF_OUTPUT_DIR>/<name>.md when set
+BRIEF_OUTPUT_DIR = os.getenv("BRIEF_OUTPUT_DIR")
+BRIEF_WEBHOOK_URL = os.getenv("BRIEF_WEBHOOK_URL")
+BRIEF_WEBHOOK_FLUSH_CHARS = int(os.getenv("BRIEF_WEBHOOK_FLUSH_CHARS", "400"))
+
+
+class StdoutSink:
+
+    def write(self, chunk):
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+
+    def close(self, complete=True):
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+
+class FileSink:
+
+    # Streams into a temporary file, opened on the first chunk, that
+    # replaces the previous brief only once the new one is complete
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.file = None
+
+    def write(self, chunk):
+
+        if self.file is None:
+            self.file = open(self.tmp_path, "w", encoding="utf-8")
+
+        self.file.write(chunk)
+        self.file.flush()
+
+    def close(self, complete=True):
+
+        if self.file is None:
+            return
+
+        self.file.close()
+        self.file = None
+
+        if complete:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+
+class WebhookSink:
+
+    # Posts the brief in pieces of roughly flush_chars as it is written,
+    # the way a chat or dashboard consumer would receive it
+    def __init__(self, url, flush_chars=BRIEF_WEBHOOK_FLUSH_CHARS, brief=None):
+        self.url = url
+        self.flush_chars = flush_chars
+        self.brief = brief
+        self.buffer = []
+        self.buffered = 0
+        self.sequence = 0
+
+    def write(self, chunk):
+
+        self.buffer.append(chunk)
+        self.buffered += len(chunk)
+
+        if self.buffered >= self.flush_chars:
+            self.flush()
+
+    def flush(self, final=False):
+
+        import requests
+
+        text = "".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+
+        if not text and not final:
+            return
+
+        try:
+            with timed("webhook.post"):
+                http_request(
+                    "POST",
+                    self.url,
+                    json={
+                        "brief": self.brief,
+                        "sequence": self.sequence,
+                        "text": text,
+                        "final": final
+                    }
+                )
+
+        except requests.RequestException as e:
+            print("WEBHOOK SINK ERROR:", e)
+
+        self.sequence += 1
+
+    def close(self, complete=True):
+        self.flush(final=True)
+
+
+def brief_sinks(stream, output_file=BRIEF_OUTPUT_FILE, brief=None):
+
+    # stdout only when streaming; the blocking path prints the brief
+    # itself once it is complete
+    sinks = [StdoutSink()] if stream else []
+
+    if output_file:
+        sinks.append(FileSink(output_file))
+
+    if BRIEF_WEBHOOK_URL:
+        sinks.append(WebhookSink(BRIEF_WEBHOOK_URL, brief=brief))
+
+    return sinks
+
+
+# ---------------- DATE ----------------
+def report_date():
+    return datetime.date.today().strftime("%d %b %Y")
+
+
+def extract_fii_dii_from_news(news_text):
+
+    try:
+
+        prompt = f"""
+From the following financial news text extract institutional flows.
+
+Identify:
+- FII net flow
+- DII net flow
+
+Return only this format:
+
+FII Net Flow: ₹____ crore
+DII Net Flow: ₹____ crore
+
+If flows are not mentioned return:
+
+FII Net Flow: Not reported
+DII Net Flow: Not reported
+
+NEWS TEXT:
+{news_text}
+"""
+
+        return chat_completion(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "You extract financial data from financial news."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0,
+            max_tokens=120
+        )
+
+    except Exception:
+
+        return "FII Net Flow: Not reported\nDII Net Flow: Not reported"
+
+# ---------------- INDICATOR STORE ----------------
+# Local columnar copy of Indicator_History: one structured NumPy array
+# sorted by trade date, memory-mapped on read. It is written directly,
+# alongside (not through) the batched sheet writes. A stored date is
+# overwritten in place and dates after the last stored one are appended
+# in place; only dates landing before it (backfills) rewrite the file.
+INDICATOR_FIELDS = [
+    "nifty",
+    "bank_nifty",
+    "sensex",
+    "fii",
+    "dii",
+    "vix",
+    "brent",
+    "usdinr",
+    "us10y",
+    "gold",
+    "silver"
+]
+
+INDICATOR_DTYPE = np.dtype(
+    [("date", "datetime64[D]")] + [(field, "f8") for field in INDICATOR_FIELDS]
+)
+
+INDICATOR_STORE_PATH = os.path.join(CACHE_DIR, "indicator_history.npy")
+
+_indicator_store_lock = threading.Lock()
+
+
+def parse_trade_date(trade_date):
+    return np.datetime64(
+        datetime.datetime.strptime(trade_date, "%d %b %Y").date(),
+        "D"
+    )
+
+
+def load_indicator_store(mmap=True):
+
+    try:
+        return np.load(INDICATOR_STORE_PATH, mmap_mode="r" if mmap else None)
+
+    except (OSError, ValueError):
+        return np.empty(0, dtype=INDICATOR_DTYPE)
+
+
+def append_indicator_rows(rows):
+
+    # Writes rows after the last stored one, then rewrites the header
+    # with the new shape. NumPy pads .npy headers so the shape can grow
+    # without moving the data; returns False when it cannot (old format
+    # version, other dtype) and the caller rewrites the file instead.
+    fmt = np.lib.format
+
+    header_readers = {
+        (1, 0): fmt.read_array_header_1_0,
+        (2, 0): fmt.read_array_header_2_0
+    }
+    header_writers = {
+        (1, 0): fmt.write_array_header_1_0,
+        (2, 0): fmt.write_array_header_2_0
+    }
+
+    with open(INDICATOR_STORE_PATH, "r+b") as f:
+
+        version = fmt.read_magic(f)
+
+        if version not in header_readers:
+            return False
+
+        shape, fortran_order, dtype = header_readers[version](f)
+        data_offset = f.tell()
+
+        if dtype != INDICATOR_DTYPE or len(shape) != 1:
+            return False
+
+        header = io.BytesIO()
+        header_writers[version](header, {
+            "descr": fmt.dtype_to_descr(dtype),
+            "fortran_order": fortran_order,
+            "shape": (shape[0] + len(rows),)
+        })
+
+        if len(header.getvalue()) != data_offset:
+            return False
+
+        # Rows first: a crash before the header update leaves the old
+        # shape, and the bytes past it are overwritten next time
+        f.seek(data_offset + shape[0] * dtype.itemsize)
+        f.write(rows.tobytes())
+        f.truncate()
+        f.flush()
+
+        f.seek(0)
+        f.write(header.getvalue())
+
+    return True
+
+
+def upsert_in_place(new):
+
+    # Row count after overwriting stored dates and appending later ones
+    # in place, or None when new dates fall before the last stored one
+    store = np.load(INDICATOR_STORE_PATH, mmap_mode="r+")
+
+    positions = np.searchsorted(store["date"], new["date"])
+    stored = positions < len(store)
+    stored[stored] = store["date"][positions[stored]] == new["date"][stored]
+
+    appended = np.sort(new[~stored], order="date")
+
+    if len(appended) and (
+        (len(store) and appended["date"][0] <= store["date"][-1])
+        or len(np.unique(appended["date"])) < len(appended)
+    ):
+        return None
+
+    store[positions[stored]] = new[stored]
+    store.flush()
+
+    rows = len(store)
+
+    del store
+
+    if len(appended) and not append_indicator_rows(appended):
+        return None
+
+    return rows + len(appended)
+
+
+def upsert_indicator_store(records):
+
+    # records: list of (trade_date string, {field: value}). Dates
+    # already stored are overwritten in place and later dates appended;
+    # otherwise the merged array is swapped in atomically.
+    new = np.empty(len(records), dtype=INDICATOR_DTYPE)
+
+    for i, (trade_date, values) in enumerate(records):
+
+        new["date"][i] = parse_trade_date(trade_date)
+
+        for field in INDICATOR_FIELDS:
+
+            value = values.get(field)
+
+            try:
+                new[field][i] = float(value)
+            except (TypeError, ValueError):
+                new[field][i] = np.nan
+
+    with _indicator_store_lock:
+
+        try:
+            rows = upsert_in_place(new)
+        except (OSError, ValueError):
+            rows = None
+
+        if rows is not None:
+            return rows
+
+        store = load_indicator_store(mmap=False)
+
+        merged = np.concatenate([
+            store[~np.isin(store["date"], new["date"])],
+            new
+        ])
+
+        merged.sort(order="date")
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        tmp_path = INDICATOR_STORE_PATH + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            np.save(f, merged)
+
+        os.replace(tmp_path, INDICATOR_STORE_PATH)
+
+    return len(merged)
+
+
+def load_indicator_history(start=None, end=None):
+
+    # DataFrame indexed by trade date, optionally sliced to [start, end]
+    import pandas as pd
+
+    store = load_indicator_store()
+
+    if start is not None:
+        store = store[store["date"] >= np.datetime64(start, "D")]
+
+    if end is not None:
+        store = store[store["date"] <= np.datetime64(end, "D")]
+
+    return pd.DataFrame(
+        {field: store[field] for field in INDICATOR_FIELDS},
+        index=pd.DatetimeIndex(store["date"], name="date")
+    )
+
+
+# ---------------- GOOGLE SHEETS ----------------
+SPREADSHEET_ID = "1vSuZmhAYVgBhTz4nx9g_fZnmV2ulEUJwisjIWfoQK64"
+
+SHEETS_SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+SHEETS_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_spreadsheet = None
+_worksheets = {}
+_sheets_lock = threading.RLock()
+
+
+def sheets_call(func, *args, **kwargs):
+
+    # Retries quota (429) and transient server errors with exponential
+    # backoff plus jitter. Anything else is raised immediately.
+    import gspread
+
+    for attempt in range(SHEETS_MAX_RETRIES):
+
+        try:
+            count("sheets_calls")
+
+            with timed(f"sheets.{getattr(func, '__name__', 'call')}"):
+                return func(*args, **kwargs)
+
+        except gspread.exceptions.APIError as e:
+
+            status = e.response.status_code
+
+            if status not in SHEETS_RETRY_STATUSES or attempt == SHEETS_MAX_RETRIES - 1:
+                raise
+
+            delay = min(2 ** attempt, 32) + random.uniform(0, 1)
+
+            print(f"SHEETS API {status}, retrying in {delay:.1f}s")
+
+            time.sleep(delay)
+
+
+def get_spreadsheet():
+
+    # Authorizes once per run; every worksheet shares this client's
+    # HTTP session and the single spreadsheet handle.
+    global _spreadsheet
+
+    with _sheets_lock:
+
+        if _spreadsheet is None:
+
+            import gspread
+            from google.oauth2.service_account import Credentials
+
+            creds_json = os.getenv("GOOGLE_SERVICE_ACCOUNT")
+
+            if not creds_json:
+                raise Exception("GOOGLE_SERVICE_ACCOUNT secret not found.")
+
+            creds = Credentials.from_service_account_info(
+                json.loads(creds_json),
+                scopes=SHEETS_SCOPES
+            )
+
+            client = gspread.authorize(creds)
+
+            _spreadsheet = sheets_call(client.open_by_key, SPREADSHEET_ID)
+
+        return _spreadsheet
+
+
+def get_worksheet(title=None):
+
+    # title=None is the first sheet (the daily brief log)
+    with _sheets_lock:
+
+        if title not in _worksheets:
+
+            spreadsheet = get_spreadsheet()
+
+            if title is None:
+                _worksheets[title] = sheets_call(spreadsheet.get_worksheet, 0)
+            else:
+                _worksheets[title] = sheets_call(spreadsheet.worksheet, title)
+
+        return _worksheets[title]
+
+
+# ---------------- DATE INDEX ----------------
+# Column A of each worksheet is kept in .cache between runs. A run only
+# re-reads a bounded tail: from a few rows before the last known end,
+# DATE_INDEX_TAIL_ROWS rows on. If those overlap rows no longer match
+# (rows inserted, deleted or sorted by hand) or the tail window fills
+# up, the whole column is read again.
+DATE_INDEX_PATH = os.path.join(CACHE_DIR, "sheet_dates.json")
+DATE_INDEX_OVERLAP = int(os.getenv("DATE_INDEX_OVERLAP", "5"))
+DATE_INDEX_TAIL_ROWS = int(os.getenv("DATE_INDEX_TAIL_ROWS", "200"))
+
+_date_indexes = {}
+
+
+def load_date_columns():
+
+    # worksheet title ("" for the first sheet) -> column A last run
+    try:
+        with open(DATE_INDEX_PATH) as f:
+            state = json.load(f)
+
+    except (OSError, ValueError):
+        return {}
+
+    if state.get("spreadsheet") != SPREADSHEET_ID:
+        return {}
+
+    return state.get("sheets", {})
+
+
+def save_date_columns():
+
+    # Called with _sheets_lock held
+    columns = load_date_columns()
+
+    for title, index in _date_indexes.items():
+        columns[title or ""] = index["dates"]
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        tmp_path = DATE_INDEX_PATH + ".tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump({"spreadsheet": SPREADSHEET_ID, "sheets": columns}, f)
+
+        os.replace(tmp_path, DATE_INDEX_PATH)
+
+    except OSError as e:
+        print("DATE INDEX ERROR:", e)
+
+
+def read_date_column(sheet, known):
+
+    # known: column A as of the last run, or None
+    if known:
+
+        start = max(1, len(known) - DATE_INDEX_OVERLAP + 1)
+        window = DATE_INDEX_OVERLAP + DATE_INDEX_TAIL_ROWS
+
+        tail = [
+            row[0] if row else ""
+            for row in sheets_call(sheet.get, f"A{start}:A{start + window - 1}")
+        ]
+
+        if len(tail) < window and tail[:len(known) - start + 1] == known[start - 1:]:
+            count("date_index_tail_reads")
+            return known[:start - 1] + tail
+
+        print("DATE INDEX STALE, rereading column A:", sheet.title)
+
+    return sheets_call(sheet.col_values, 1)
+
+
+def get_date_index(title=None):
+
+    # Column A only: the date of every row, in sheet order. Built once
+    # per run per worksheet and kept in step with our own appends.
+    with _sheets_lock:
+
+        if title not in _date_indexes:
+
+            sheet = get_worksheet(title)
+            dates = read_date_column(sheet, load_date_columns().get(title or ""))
+
+            set_date_index(dates, title)
+
+        return _date_indexes[title]
+
+
+def set_date_index(dates, title=None):
+
+    # dates: column A in sheet order, after a write that moved rows
+    with _sheets_lock:
+
+        rows = {}
+
+        for row_number, date_value in enumerate(dates, start=1):
+            rows.setdefault(date_value, row_number)
+
+        _date_indexes[title] = {
+            "dates": dates,
+            "rows": rows
+        }
+
+        save_date_columns()
+
+
+def find_date_row(date, title=None):
+    return get_date_index(title)["rows"].get(date)
+
+
+def record_appended_row(date, title=None):
+
+    with _sheets_lock:
+
+        index = get_date_index(title)
+
+        index["dates"].append(date)
+        index["rows"].setdefault(date, len(index["dates"]))
+
+
+# ---------------- BATCHED WRITES ----------------
+_pending_writes = []
+
+
+def queue_row_upsert(values, date, title=None):
+
+    # Nothing is sent until flush_sheet_writes
+    with _sheets_lock:
+        _pending_writes.append({
+            "title": title,
+            "date": date,
+            "values": values
+        })
+
+
+def sheet_cell(value):
+
+    # Mirrors value_input_option="RAW": strings are never parsed. NaN
+    # is not valid JSON for the API, so it is written as an empty cell.
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return {}
+
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+
+    if isinstance(value, numbers.Number):
+        return {"userEnteredValue": {"numberValue": float(value)}}
+
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+
+def flush_sheet_writes():
+
+    # Every queued upsert across all worksheets goes out as a single
+    # spreadsheets.batchUpdate, which the API applies atomically.
+    with _sheets_lock:
+
+        if not _pending_writes:
+            return
+
+        spreadsheet = get_spreadsheet()
+
+        requests_body = []
+        appended = []
+
+        for write in _pending_writes:
+
+            sheet = get_worksheet(write["title"])
+            row_number = find_date_row(write["date"], write["title"])
+
+            row = {"values": [sheet_cell(value) for value in write["values"]]}
+
+            if row_number:
+
+                requests_body.append({
+                    "updateCells": {
+                        "rows": [row],
+                        "fields": "userEnteredValue",
+                        "start": {
+                            "sheetId": sheet.id,
+                            "rowIndex": row_number - 1,
+                            "columnIndex": 0
+                        }
+                    }
+                })
+
+                print(f"Updating {sheet.title} row {row_number} for {write['date']}")
+
+            elif requests_body and requests_body[-1].get("appendCells", {}).get("sheetId") == sheet.id:
+
+                # Consecutive appends to one sheet share a request
+                requests_body[-1]["appendCells"]["rows"].append(row)
+
+                appended.append(write)
+
+                print(f"Appending {sheet.title} row for {write['date']}")
+
+            else:
+
+                requests_body.append({
+                    "appendCells": {
+                        "sheetId": sheet.id,
+                        "rows": [row],
+                        "fields": "userEnteredValue"
+                    }
+                })
+
+                appended.append(write)
+
+                print(f"Appending {sheet.title} row for {write['date']}")
+
+        sheets_call(spreadsheet.batch_update, {"requests": requests_body})
+
+        for write in appended:
+            record_appended_row(write["date"], write["title"])
+
+        if appended:
+            save_date_columns()
+
+        _pending_writes.clear()
+
+
+def parse_sheet_date(value):
+
+    try:
+        return datetime.datetime.strptime(value, "%d %b %Y").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def insert_dated_rows(rows, title=None):
+
+    # rows: [date, ...] lists whose dates are not in the sheet yet. Each
+    # is inserted above the first row with a later date, so the sheet
+    # stays in date order; rows later than every date are appended.
+    # One batchUpdate; requests apply in order, so each position already
+    # counts the rows inserted before it.
+    with _sheets_lock:
+
+        spreadsheet = get_spreadsheet()
+        sheet = get_worksheet(title)
+
+        dates = list(get_date_index(title)["dates"])
+
+        requests_body = []
+
+        for values in sorted(rows, key=lambda row: parse_sheet_date(row[0])):
+
+            day = parse_sheet_date(values[0])
+
+            position = next(
+                (
+                    i for i, date_value in enumerate(dates)
+                    if (parse_sheet_date(date_value) or day) > day
+                ),
+                len(dates)
+            )
+
+            row = {"values": [sheet_cell(value) for value in values]}
+
+            previous = requests_body[-1] if requests_body else {}
+
+            if position == len(dates) and "appendCells" in previous:
+                previous["appendCells"]["rows"].append(row)
+
+            elif position == len(dates):
+                requests_body.append({
+                    "appendCells": {
+                        "sheetId": sheet.id,
+                        "rows": [row],
+                        "fields": "userEnteredValue"
+                    }
+                })
+
+            elif "updateCells" in previous and \
+                    previous["updateCells"]["start"]["rowIndex"] + len(previous["updateCells"]["rows"]) == position:
+
+                # Extends the run inserted just above
+                requests_body[-2]["insertDimension"]["range"]["endIndex"] += 1
+                previous["updateCells"]["rows"].append(row)
+
+            else:
+                requests_body.append({
+                    "insertDimension": {
+                        "range": {
+                            "sheetId": sheet.id,
+                            "dimension": "ROWS",
+                            "startIndex": position,
+                            "endIndex": position + 1
+                        },
+                        "inheritFromBefore": position > 0
+                    }
+                })
+                requests_body.append({
+                    "updateCells": {
+                        "rows": [row],
+                        "fields": "userEnteredValue",
+                        "start": {
+                            "sheetId": sheet.id,
+                            "rowIndex": position,
+                            "columnIndex": 0
+                        }
+                    }
+                })
+
+            dates.insert(position, values[0])
+
+            print(f"Inserting {sheet.title} row {position + 1} for {values[0]}")
+
+        if requests_body:
+            sheets_call(spreadsheet.batch_update, {"requests": requests_body})
+            set_date_index(dates, title)
+
+
+# ---------------- HISTORICAL DATA ----------------
+def fetch_history_rows():
+
+    # [date, market, global, flows] for the 5 most recent unique dates,
+    # oldest first. Rows with a snapshot column (G) load as snapshots;
+    # older rows fall back to the text blobs in B:D.
+    sheet = get_worksheet()
+
+    dates = get_date_index()["dates"]
+
+    # Last row of each of the 5 most recent unique dates
+    row_numbers = []
+    seen_dates = set()
+
+    for row_number in range(len(dates), 0, -1):
+
+        date_value = dates[row_number - 1]
+
+        if not date_value:
+            continue
+
+        if date_value not in seen_dates:
+            row_numbers.append(row_number)
+            seen_dates.add(date_value)
+
+        if len(row_numbers) == 5:
+            break
+
+    if not row_numbers:
+        return []
+
+    value_ranges = sheets_call(
+        sheet.batch_get,
+        [f"A{row_number}:G{row_number}" for row_number in row_numbers]
+    )
+
+    unique_rows = []
+
+    for value_range in value_ranges:
+
+        # batch_get drops trailing empty cells, pad back to 7 columns
+        row = ((list(value_range[0]) if value_range else []) + [""] * 7)[:7]
+
+        try:
+            snapshots = load_snapshots(row[6]) if row[6] else None
+        except ValueError:
+            snapshots = None
+
+        if snapshots:
+            unique_rows.append([row[0], snapshots["market"], snapshots["global"], snapshots["flows"]])
+        else:
+            unique_rows.append(row[:4])
+
+    return list(reversed(unique_rows))
+
+
+def format_history_row(row):
+    return f"""
+DATE: {row[0]}
+
+MARKET:
+{render_snapshot(row[1], compact=True)}
+
+GLOBAL:
+{render_snapshot(row[2], compact=True)}
+
+FLOWS:
+{render_snapshot(row[3], compact=True)}
+"""
+
+
+def format_history(rows):
+    return "\n\n".join(format_history_row(row) for row in rows)
+
+
+def get_recent_market_history():
+
+    try:
+
+        return format_history(fetch_history_rows())
+
+    except Exception as e:
+
+        return f"Historical data unavailable: {str(e)}"
+        
+# ---------------- BACKFILL ----------------
+# Rebuilds Indicator_History for a date range from one bulk download,
+# instead of one cron run per day.
+BACKFILL_CHUNK_ROWS = int(os.getenv("BACKFILL_CHUNK_ROWS", "200"))
+
+# Extra days downloaded before start so the first session has a prior
+# close to carry forward for markets that were shut that day
+BACKFILL_LOOKBACK_DAYS = 10
+
+INDICATOR_SHEET = "Indicator_History"
+
+# Price indicators and the symbol each one is read from; fii/dii come
+# from NSE and are not in the quote panel
+INDICATOR_SYMBOLS = {
+    **INDIA_SYMBOLS,
+    **{
+        name: GLOBAL_SYMBOLS[name]
+        for name in ("vix", "brent", "usdinr", "us10y", "gold", "silver")
+    }
+}
+
+
+def indicator_frame(start, end):
+
+    # Closes for every price indicator on each NIFTY session in
+    # [start, end]. Other markets carry their last close forward over
+    # days they were shut.
+    import pandas as pd
+
+    panel = fetch_quote_panel(
+        list(INDICATOR_SYMBOLS.values()),
+        start=(start - datetime.timedelta(days=BACKFILL_LOOKBACK_DAYS)).isoformat(),
+        end=(end + datetime.timedelta(days=1)).isoformat()
+    )
+
+    sessions = panel.index[panel[INDIA_SYMBOLS["nifty"]].notna()]
+    sessions = sessions[(sessions >= pd.Timestamp(start)) & (sessions <= pd.Timestamp(end))]
+
+    frame = panel.ffill().loc[sessions].round(2)
+    frame.columns = list(INDICATOR_SYMBOLS)
+
+    return frame
+
+
+def parse_sheet_number(value):
+
+    try:
+        return float(str(value).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def backfill_flows(dates, start, end):
+
+    # {date: (fii, dii)} from the local store, falling back to what the
+    # sheet already holds so a rebuild never blanks recorded flows
+    flows = {}
+
+    history = load_indicator_history(start, end)
+
+    for day, fii, dii in zip(history.index, history["fii"], history["dii"]):
+        flows[day.strftime("%d %b %Y")] = (
+            None if np.isnan(fii) else float(fii),
+            None if np.isnan(dii) else float(dii)
+        )
+
+    index = get_date_index(INDICATOR_SHEET)
+
+    row_numbers = [index["rows"][date] for date in dates if date in index["rows"]]
+
+    if not row_numbers:
+        return flows
+
+    # Columns E:F hold FII and DII
+    sheet = get_worksheet(INDICATOR_SHEET)
+    values = sheets_call(sheet.get, f"E1:F{max(row_numbers)}")
+
+    for date in dates:
+
+        row_number = index["rows"].get(date)
+
+        if not row_number or row_number > len(values):
+            continue
+
+        cells = (list(values[row_number - 1]) + ["", ""])[:2]
+        sheet_flows = [parse_sheet_number(cell) if cell != "" else None for cell in cells]
+
+        stored = flows.get(date, (None, None))
+
+        flows[date] = tuple(
+            stored_value if stored_value is not None else sheet_value
+            for stored_value, sheet_value in zip(stored, sheet_flows)
+        )
+
+    return flows
+
+
+@timed("backfill")
+def backfill_indicator_history(start, end, chunk_rows=BACKFILL_CHUNK_ROWS):
+
+    # start/end: datetime.date. Returns the number of sessions written.
+    frame = indicator_frame(start, end)
+
+    if frame.empty:
+        print(f"No NIFTY sessions between {start} and {end}")
+        return 0
+
+    dates = [day.strftime("%d %b %Y") for day in frame.index]
+    flows = backfill_flows(dates, start, end)
+
+    records = []
+
+    for date, prices in zip(dates, frame.to_dict("records")):
+
+        fii, dii = flows.get(date, (None, None))
+
+        records.append((date, {**prices, "fii": fii, "dii": dii}))
+
+    print("Indicator store rows:", upsert_indicator_store(records))
+
+    # Dates already in the sheet are updated where they are; new ones
+    # are inserted in date order rather than appended after the tail
+    for offset in range(0, len(records), chunk_rows):
+
+        chunk = records[offset:offset + chunk_rows]
+        missing = []
+
+        for date, values in chunk:
+
+            row = [date] + [values[field] for field in INDICATOR_FIELDS]
+
+            if find_date_row(date, INDICATOR_SHEET):
+                queue_row_upsert(row, date, INDICATOR_SHEET)
+            else:
+                missing.append(row)
+
+        flush_sheet_writes()
+        insert_dated_rows(missing, INDICATOR_SHEET)
+
+        print(f"Backfilled {chunk[0][0]} -> {chunk[-1][0]} ({len(chunk)} rows)")
+
+    return len(records)
+
+
+# ---------------- DATA COLLECTION ----------------
+SOURCE_TIMEOUTS = {
+    "market": float(os.getenv("MARKET_TIMEOUT_SECONDS", "60")),
+    "news": float(os.getenv("NEWS_TIMEOUT_SECONDS", str(NEWS_DEADLINE_SECONDS + 60))),
+    "global": float(os.getenv("GLOBAL_TIMEOUT_SECONDS", "60")),
+    "history": float(os.getenv("HISTORY_TIMEOUT_SECONDS", "60")),
+    "flows": float(os.getenv("FLOWS_TIMEOUT_SECONDS", "30")),
+    "sectors": float(os.getenv("SECTORS_TIMEOUT_SECONDS", "60"))
+}
+
+
+def collect_sources(sources, timeouts=SOURCE_TIMEOUTS):
+
+    # sources maps name -> (fetch function, fallback value). Every source
+    # starts at once; each gets its own timeout measured from the shared
+    # start, and a source that fails or times out yields its fallback.
+    timings = {}
+    collection_start = time.time()
+
+    def run(name, fetch):
+
+        start = time.time()
+
+        try:
+            return fetch()
+        finally:
+            end = time.time()
+
+            timings[name] = {
+                "start": round(start - collection_start, 3),
+                "end": round(end - collection_start, 3)
+            }
+
+            record_timing(f"source.{name}", end - start)
+
+    executor = ThreadPoolExecutor(max_workers=len(sources))
+
+    futures = {
+        name: executor.submit(run, name, fetch)
+        for name, (fetch, _) in sources.items()
+    }
+
+    results = {}
+
+    for name, future in futures.items():
+
+        fallback = sources[name][1]
+        remaining = collection_start + timeouts.get(name, 60) - time.time()
+
+        try:
+            results[name] = future.result(timeout=max(remaining, 0))
+
+        except FuturesTimeoutError:
+            print(f"SOURCE TIMED OUT: {name}")
+            results[name] = fallback
+
+        except Exception as e:
+            print(f"SOURCE FAILED: {name}: {e}")
+            results[name] = fallback
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    print("----- COLLECTION TIMINGS -----")
+
+    for name in sources:
+
+        if name in timings:
+            print(f"{name}: {timings[name]['start']:.2f}s -> {timings[name]['end']:.2f}s")
+        else:
+            print(f"{name}: did not finish")
+
+    print(f"total: {time.time() - collection_start:.2f}s")
+    print("------------------------------")
+
+    return results, timings
+
+
+# ---------------- SOURCES ----------------
+def pipeline_sources(configs):
+
+    # name -> (fetch function, fallback used on timeout or error), for
+    # the union of what the selected briefs read. News is collected once
+    # over every brief's feeds and keywords, then narrowed and
+    # de-duplicated per brief, so a near copy from another brief's feed
+    # never displaces a brief's own story.
+    feeds = list(dict.fromkeys(feed for config in configs for feed in config.feeds))
+    keywords_re = keyword_pattern(dict.fromkeys(
+        keyword for config in configs for keyword in config.keywords
+    ))
+
+    available = {
+        "market": (fetch_market_data, None),
+        "news": (lambda: collect_market_articles(feeds, keywords_re, dedupe=False), None),
+        "global": (fetch_global_data, None),
+        "history": (fetch_history_rows, None),
+        "flows": (fetch_fii_dii_data, FlowSnapshot(error="timed out")),
+        "sectors": (fetch_sector_breadth, "Sector data unavailable.")
+    }
+
+    wanted = {name for config in configs for name in config.sources}
+
+    sources = {name: source for name, source in available.items() if name in wanted}
+
+    # Per-brief quote snapshots all read the one shared panel download
+    for config in configs:
+        if "quotes" in config.sources:
+            sources[f"quotes.{config.name}"] = (
+                lambda config=config: fetch_brief_quotes(config),
+                None
+            )
+
+    return sources
+
+
+# ---------------- LIVE DATA VARIABLES ----------------
+def prepare_run(collected):
+
+    # The named values the prompt and the sheet rows are built from.
+    # Snapshot text is rendered here, once, for the prompt and Sheet1.
+    market = collected["market"]
+
+    if market is None:
+        trade_date = "Unknown"
+        market_data = "Market data unavailable."
+        closes = {name: None for name in INDIA_SYMBOLS}
+    else:
+        trade_date = market.trade_date
+        market_data = market.render()
+        closes = {name: market.close(name) for name in INDIA_SYMBOLS}
+
+    print("NIFTY:", closes["nifty"])
+    print("BANK NIFTY:", closes["bank_nifty"])
+    print("SENSEX:", closes["sensex"])
+    print("MARKET SESSION DATE:", trade_date)
+
+    news_articles = brief_articles(collected["news"], BRIEFS["india"])
+
+    if news_articles is None:
+        news_data = "News data unavailable."
+    else:
+        news_data = format_news(news_articles[:6])
+
+    global_snapshot = collected["global"]
+    global_fields = ("vix", "brent", "usdinr", "us10y", "gold", "silver")
+
+    if global_snapshot is None:
+        global_data = "Global data unavailable."
+        closes.update({name: None for name in global_fields})
+    else:
+        global_data = global_snapshot.render()
+        closes.update({name: global_snapshot.close(name) for name in global_fields})
+
+    for name in global_fields:
+        print(f"{name.upper()}:", closes[name])
+
+    history_rows = collected["history"]
+
+    if history_rows is None:
+        historical_data = "Historical data unavailable."
+    else:
+        historical_data = format_history(history_rows)
+
+    sector_data = collected["sectors"]
+
+    print("----- SECTOR DATA -----")
+    print(sector_data)
+    print("-----------------------")
+
+    print("----- HISTORICAL DATA -----")
+    print(historical_data)
+    print("---------------------------")
+
+    print("----- GLOBAL DATA -----")
+    print(global_data)
+    print("-----------------------")
+
+    flows = collected["flows"]
+
+    if flows.error:
+        print("FLOWS ERROR:", flows.error)
+
+    print("MARKET DATE:", trade_date)
+    print("FII DATE:", flows.date or "Unknown")
+
+    if flows.date != trade_date:
+        print("WARNING: MARKET DATE AND FII DATE DO NOT MATCH")
+
+    print("FII VALUE:", flows.fii)
+    print("DII VALUE:", flows.dii)
+
+    return {
+        "trade_date": trade_date,
+        "market": market,
+        "market_data": market_data,
+        **closes,
+        "news_articles": news_articles,
+        "news_data": news_data,
+        "global": global_snapshot,
+        "global_data": global_data,
+        "history_rows": history_rows,
+        "historical_data": historical_data,
+        "sector_data": sector_data,
+        "flow_snapshot": flows,
+        "flows": flows.render(),
+        "fii": flows.fii,
+        "dii": flows.dii
+    }
+
+
+# ---------------- PROMPT BUILDER ----------------
+ANALYSIS_TEMPLATE = """
+You are a professional equity market strategist writing a concise daily market brief.
+
+Your goal is to explain **what happened, why it happened, and what investors should understand**.
+
+Use the information below but you may **interpret relationships between market data and news logically**.
+
+Avoid generic statements. Focus on **drivers and context**.
+
+If FII/DII flows are not available, explicitly state that they were not reported and avoid inferring institutional behaviour.
+
+REPORT DATE:
+{report_date}
+
+MARKET SESSION DATE:
+{trade_date}
+
+DOMESTIC MARKET DATA:
+{market_data}
+
+GLOBAL MARKET DATA:
+{global_data}
+
+RECENT MARKET HISTORY:
+{historical_data}
+
+INSTITUTIONAL FLOWS:
+{flows}
+
+SECTOR & BREADTH DATA:
+{sector_data}
+
+MARKET NEWS (full articles):
+{news_data}
+
+Write a professional research-style brief using this structure:
+MARKET ANALYSIS RULES
+
+When identifying catalysts, use the following priority:
+
+1. Market price action
+2. FII/DII flows
+3. India VIX
+4. Crude oil
+5. USD/INR
+6. Bond yields
+7. Historical trend data
+8. News articles
+
+Do not assume a news article caused market movement.
+
+News should only be cited as a catalyst if there is a clear and direct connection between the observed market behaviour.
+
+If market data and news conflict, prioritise market data.
+
+Institutional flows, volatility indicators, crude oil and currency movements should generally be given more weight than individual corporate or regulatory news items.
+
+MARKET OVERVIEW
+Summarize the overall session in India. Mention index performance and volatility.
+
+KEY CATALYSTS
+Identify the most likely drivers based on the news and data provided.
+
+SECTOR / MARKET IMPACT
+Explain which parts of the market appear most affected, using the sector returns and NIFTY 50 breadth provided.
+
+GLOBAL CONTEXT & RISK INDICATORS
+
+Discuss the following indicators and what they imply:
+
+• S&P 500
+• NASDAQ
+• DOW JONES
+• USD/INR
+• Brent Crude
+• India VIX
+• US 10Y Treasury Yield
+• Gold
+• Silver
+
+Explain what they suggest about:
+
+- Global risk appetite
+- Market volatility
+- Inflation expectations
+- Safe-haven demand
+- Investor positioning
+
+Explain how VIX, crude oil, USD/INR, bond yields, gold and silver influence risk sentiment.
+
+Do not merely repeat the numbers.
+Interpret their significance.
+
+INSTITUTIONAL FLOWS
+Explain how FII/DII flows align or diverge with the market move.
+
+INVESTOR TAKEAWAY
+Compare today's session with the recent market history.
+
+Discuss:
+
+• Whether today's move is part of an ongoing trend
+• Whether institutional behaviour is changing
+• Whether volatility is rising or falling
+• Whether risk appetite is improving or deteriorating
+
+Avoid discussing today's data in isolation.
+
+
+Style guidelines:
+
+
+• Write like a professional research desk note
+• Avoid generic commentary
+• Be analytical but concise
+• Do NOT give predictions or buy/sell calls
+• Use clear financial language
+
+• When India VIX is available:
+  Explain whether volatility expectations are rising or falling.
+
+• When US 10Y Treasury Yield is available:
+  Explain what it may indicate about global interest-rate expectations and liquidity conditions.
+
+• When Gold and Silver are available:
+  Discuss whether price action suggests risk-on or risk-off sentiment.
+
+• When Brent Crude is available:
+  Explain the implications for India as a major oil importer.
+
+• Distinguish facts from interpretations.
+
+• Do not attribute market movements to a single headline unless strongly supported by market data. 
+"""
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_MAX_ARTICLES = 6
+PROMPT_MIN_ARTICLES = 2
+PROMPT_MIN_HISTORY_DAYS = 2
+PROMPT_MIN_ARTICLE_CHARS = 400
+
+BOILERPLATE_RE = re.compile(
+    r"^(also read|read more|read also|follow us|subscribe|disclaimer|download the"
+    r"|click here|catch all the|first published|published on|updated on"
+    r"|\(this story|\(disclaimer|for more|you might also like|share this)",
+    re.IGNORECASE
+)
+
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Figures and named instruments a catalyst usually comes with
+ENTITY_RE = re.compile(
+    r"\d+(?:\.\d+)?\s*(?:%|per cent|crore|bps|basis points)|₹|\brs\.?\s*\d|\$\d"
+    r"|\bbank nifty\b|\bnse\b|\bbse\b|\bsebi\b|\brepo\b|\bbrent\b|\bdollar\b",
+    re.IGNORECASE
+)
+
+_token_encoder = None
+
+
+def count_tokens(text):
+
+    # tiktoken when installed, otherwise the usual ~4 chars per token
+    global _token_encoder
+
+    if _token_encoder is None:
+
+        try:
+            import tiktoken
+            _token_encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _token_encoder = False
+
+    if _token_encoder:
+        return len(_token_encoder.encode(text))
+
+    return len(text) // 4
+
+
+def normalize_sentence(sentence):
+    return re.sub(r"[^a-z0-9]+", " ", sentence.lower()).strip()
+
+
+def clean_article_text(text, seen_sentences):
+
+    # Drops boilerplate lines and any sentence already used by a
+    # higher-ranked article
+    kept = []
+
+    for line in text.splitlines():
+
+        line = line.strip()
+
+        if not line or BOILERPLATE_RE.match(line):
+            continue
+
+        for sentence in SENTENCE_SPLIT_RE.split(line):
+
+            key = normalize_sentence(sentence)
+
+            if not key or key in seen_sentences or BOILERPLATE_RE.match(sentence):
+                continue
+
+            seen_sentences.add(key)
+            kept.append(sentence)
+
+    return " ".join(kept)
+
+
+def score_article(article, keywords_re=MARKET_KEYWORDS_RE):
+
+    title_hits = len(keywords_re.findall(article["title"]))
+    text_hits = len(keywords_re.findall(article["text"]))
+    entity_hits = len(ENTITY_RE.findall(article["title"] + " " + article["text"]))
+
+    return 3 * title_hits + text_hits + entity_hits
+
+
+def compact_block(text):
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+@timed("prompt.build")
+def build_analysis_input(sections, articles, history_rows, budget=PROMPT_TOKEN_BUDGET,
+                         template=ANALYSIS_TEMPLATE, keywords_re=MARKET_KEYWORDS_RE):
+
+    # sections: the fixed template fields. articles and history_rows are
+    # trimmed, lowest value first, until the prompt fits the budget:
+    # lowest-ranked articles, then oldest history days, then article
+    # length. Articles are ranked by hits on the brief's keywords_re.
+    if articles is None:
+        ranked = None
+    else:
+        ranked = sorted(
+            articles,
+            key=lambda article: score_article(article, keywords_re),
+            reverse=True
+        )[:PROMPT_MAX_ARTICLES]
+
+        seen_sentences = set()
+
+        ranked = [
+            {**article, "text": clean_article_text(article["text"], seen_sentences)}
+            for article in ranked
+        ]
+
+    if history_rows is not None:
+        history_rows = [
+            [row[0]] + [compact_block(render_snapshot(cell, compact=True)) for cell in row[1:]]
+            for row in history_rows
+        ]
+
+    def render():
+
+        if ranked is None:
+            news_data = "News data unavailable."
+        else:
+            news_data = format_news(ranked)
+
+        if history_rows is None:
+            historical_data = "Historical data unavailable."
+        else:
+            historical_data = format_history(history_rows)
+
+        return template.format(
+            news_data=news_data,
+            historical_data=historical_data,
+            **sections
+        )
+
+    prompt = render()
+    tokens = count_tokens(prompt)
+
+    while tokens > budget:
+
+        if ranked and len(ranked) > PROMPT_MIN_ARTICLES:
+            ranked.pop()
+
+        elif history_rows and len(history_rows) > PROMPT_MIN_HISTORY_DAYS:
+            history_rows.pop(0)
+
+        elif ranked and max(len(article["text"]) for article in ranked) > PROMPT_MIN_ARTICLE_CHARS:
+            for article in ranked:
+                limit = max(len(article["text"]) * 3 // 4, PROMPT_MIN_ARTICLE_CHARS)
+                article["text"] = article["text"][:limit]
+
+        else:
+            break
+
+        prompt = render()
+        tokens = count_tokens(prompt)
+
+    count("prompt_tokens_estimated", tokens)
+
+    print(f"PROMPT TOKENS: {tokens} (budget {budget})")
+
+    return prompt
+
+
+# ---------------- BRIEF CONFIGS ----------------
+# Each brief names its symbols, feeds, keywords, prompt and sinks, plus
+# the shared sources it reads. A run collects the union of sources for
+# the selected briefs once; only prompt assembly and the OpenAI call are
+# per brief, so cost grows with sources rather than with briefs.
+PANEL_TEMPLATE = """
+You are a professional markets strategist writing a concise daily {title}.
+
+Your goal is to explain **what happened, why it happened, and what investors should understand**.
+
+Use the information below but you may **interpret relationships between market data and news logically**.
+
+REPORT DATE:
+{report_date}
+
+MARKET SESSION DATE:
+{trade_date}
+
+MARKET DATA:
+{market_data}
+
+MARKET NEWS (full articles):
+{news_data}
+
+Write a professional research-style brief using this structure:
+
+MARKET OVERVIEW
+Summarize the session for these markets. Mention the size of the moves and volatility.
+
+KEY CATALYSTS
+Identify the most likely drivers based on the news and data provided.
+Do not assume a news article caused market movement; if market data and news conflict, prioritise market data.
+
+CROSS-ASSET CONTEXT
+Explain what the moves imply for risk sentiment, rates, the dollar and commodities where relevant.
+
+INVESTOR TAKEAWAY
+Explain how the 5-day and 20-day returns and the volatility readings frame today's session.
+
+Style guidelines:
+
+• Write like a professional research desk note
+• Be analytical but concise
+• Do NOT give predictions or buy/sell calls
+• Distinguish facts from interpretations.
+"""
+
+BRIEF_MAX_CONCURRENCY = int(os.getenv("BRIEF_MAX_CONCURRENCY", "3"))
+
+# Comma-separated brief names, or "all"
+BRIEF_NAMES = os.getenv("BRIEFS", "india")
+
+
+@dataclass(slots=True)
+class BriefConfig:
+    name: str
+    title: str
+    symbols: dict
+    keywords: list
+    template: str = PANEL_TEMPLATE
+    feeds: tuple = tuple(NEWS_SOURCES)
+    sources: tuple = ("quotes", "news")
+    system_prompt: str = "You are a professional markets strategist."
+    # Worksheet the brief is written to on publish (None is Sheet1)
+    sheet: str = None
+    publish: bool = False
+    output_file: str = None
+
+
+def brief_output_file(name):
+    return os.path.join(BRIEF_OUTPUT_DIR, f"{name}.md") if BRIEF_OUTPUT_DIR else None
+
+
+BRIEFS = {
+    config.name: config
+    for config in (
+        BriefConfig(
+            name="india",
+            title="daily market brief",
+            symbols={**INDIA_SYMBOLS, **GLOBAL_SYMBOLS},
+            keywords=MARKET_KEYWORDS,
+            template=ANALYSIS_TEMPLATE,
+            sources=("market", "global", "history", "flows", "sectors", "news"),
+            system_prompt="You are a professional equity market analyst.",
+            publish=True,
+            output_file=BRIEF_OUTPUT_FILE
+        ),
+        BriefConfig(
+            name="us_equity",
+            title="US equity market brief",
+            symbols={
+                "sp500": "^GSPC",
+                "nasdaq": "^IXIC",
+                "dow": "^DJI",
+                "russell": "^RUT",
+                "us_vix": "^VIX",
+                "us10y": "^TNX"
+            },
+            keywords=[
+                "wall street", "s&p", "nasdaq", "dow jones", "fed", "federal reserve",
+                "treasur*", "us stock*", "us economy", "jobs data", "payroll*"
+            ],
+            feeds=tuple(US_NEWS_SOURCES),
+            sheet="US_Equity",
+            output_file=brief_output_file("us_equity")
+        ),
+        BriefConfig(
+            name="commodities",
+            title="commodities brief",
+            symbols={
+                "brent": "BZ=F",
+                "wti": "CL=F",
+                "natgas": "NG=F",
+                "gold": "GC=F",
+                "silver": "SI=F",
+                "copper": "HG=F"
+            },
+            keywords=[
+                "crude", "brent", "wti", "oil", "opec*", "gold", "silver", "copper",
+                "natural gas", "commodit*", "metal*"
+            ],
+            feeds=tuple(COMMODITY_NEWS_SOURCES),
+            sheet="Commodities",
+            output_file=brief_output_file("commodities")
+        ),
+        BriefConfig(
+            name="fx_rates",
+            title="FX and rates brief",
+            symbols={
+                "dxy": "DX-Y.NYB",
+                "usdinr": "INR=X",
+                "eurusd": "EURUSD=X",
+                "usdjpy": "JPY=X",
+                "us5y": "^FVX",
+                "us10y": "^TNX"
+            },
+            keywords=[
+                "rupee*", "dollar*", "forex", "currenc*", "yield*", "bond*", "rbi",
+                "repo rate", "fed", "inflation", "interest rate*"
+            ],
+            feeds=tuple(FX_NEWS_SOURCES),
+            sheet="FX_Rates",
+            output_file=brief_output_file("fx_rates")
+        )
+    )
+}
+
+
+def select_briefs(names):
+
+    # "india,us_equity" or "all" -> [BriefConfig]
+    names = [name.strip() for name in names.split(",") if name.strip()]
+
+    if names == ["all"]:
+        return list(BRIEFS.values())
+
+    unknown = [name for name in names if name not in BRIEFS]
+
+    if unknown:
+        raise ValueError(f"Unknown briefs: {', '.join(unknown)} (known: {', '.join(BRIEFS)})")
+
+    return [BRIEFS[name] for name in names]
+
+
+def fetch_brief_quotes(config):
+
+    # MarketSnapshot over the brief's own symbols, read from the shared
+    # panel. Symbols the download came back without are left out.
+    panel = fetch_quote_panel()
+
+    symbols = {
+        name: symbol
+        for name, symbol in config.symbols.items()
+        if symbol in panel.columns and panel[symbol].count() > 1
+    }
+
+    if not symbols:
+        return None
+
+    closes = panel[list(symbols.values())]
+    stats = compute_indicators(closes)
+
+    return MarketSnapshot(
+        trade_date=closes.dropna(how="all").index[-1].strftime("%d %b %Y"),
+        regime=classify_regime(stats["pct"]),
+        quotes=quotes_from_stats(stats, symbols)
+    )
+
+
+def brief_articles(articles, config):
+
+    # The shared article pool narrowed to one brief's feeds and
+    # keywords, then de-duplicated within what is left
+    if articles is None:
+        return None
+
+    keywords_re = keyword_pattern(config.keywords)
+
+    return dedupe_articles([
+        article
+        for article in articles
+        if article.get("source", config.feeds[0]) in config.feeds
+        and is_market_relevant(article["title"] + " " + article["text"], keywords_re)
+    ])
+
+
+# ---------------- ANALYSIS INPUT ----------------
+def build_run_input(run, values):
+    return build_analysis_input(
+        {
+            "report_date": run["report_date"],
+            "trade_date": values["trade_date"],
+            "market_data": values["market_data"],
+            "global_data": values["global_data"],
+            "flows": values["flows"],
+            "sector_data": values["sector_data"]
+        },
+        values["news_articles"],
+        values["history_rows"]
+    )
+
+
+def brief_input(run, config, values):
+
+    # The India brief reads the full snapshot set prepared for Sheet1;
+    # panel briefs read their own quotes and the shared news pool
+    if "market" in config.sources:
+        return build_run_input(run, values)
+
+    snapshot = run["collected"].get(f"quotes.{config.name}")
+
+    return build_analysis_input(
+        {
+            "title": config.title,
+            "report_date": run["report_date"],
+            "trade_date": snapshot.trade_date if snapshot else "Unknown",
+            "market_data": render_snapshot(snapshot) if snapshot else "Market data unavailable."
+        },
+        brief_articles(run["collected"].get("news"), config),
+        None,
+        template=config.template,
+        keywords_re=keyword_pattern(config.keywords)
+    )
+
+
+def generate_ai_brief(text, stream=BRIEF_STREAM, config=None, stdout=True):
+
+    # stdout=False keeps concurrent briefs from interleaving on the
+    # terminal; file and webhook sinks still stream
+    config = config or BRIEFS["india"]
+
+    request = {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": config.system_prompt},
+            {"role": "user", "content": text}
+        ],
+        "temperature": 0.25,
+        "max_tokens": 650
+    }
+
+    sinks = brief_sinks(stream and stdout, config.output_file, config.name)
+    complete = False
+
+    # A failed completion leaves the previous brief file in place
+    try:
+        if stream:
+            brief = stream_chat_completion(sinks=sinks, **request)
+        else:
+            brief = chat_completion(**request)
+
+            for sink in sinks:
+                sink.write(brief)
+
+        complete = True
+
+        return brief
+
+    finally:
+        for sink in sinks:
+            sink.close(complete)
+
+
+def update_Indicator_history(values):
+
+    sheet_title = INDICATOR_SHEET
+    trade_date = values["trade_date"]
+
+    print("Rows in Indicator_History:", len(get_date_index(sheet_title)["dates"]))
+    print("Indicator Row:", find_date_row(trade_date, sheet_title))
+
+    new_row = [trade_date] + [values[field] for field in INDICATOR_FIELDS]
+
+    try:
+        stored = upsert_indicator_store([
+            (trade_date, dict(zip(INDICATOR_FIELDS, new_row[1:])))
+        ])
+        print("Indicator store rows:", stored)
+
+    # The local store is a copy; its failures must not stop the sheet
+    # writes queued below
+    except (ValueError, OSError) as e:
+        print("Indicator store skipped:", e)
+
+    queue_row_upsert(new_row, trade_date, sheet_title)
+
+# ---------------- WRITE TO GOOGLE SHEETS ----------------
+def update_google_sheet(date, market_data, global_data, flows, news, brief, snapshots=None):
+
+    # Check whether today's date already exists
+
+    print("Existing Row:", find_date_row(date))
+
+    new_data = [
+        date,
+        market_data,
+        global_data,
+        flows,
+        news,
+        brief
+    ]
+
+    # Column G: the same data as snapshot JSON, which later runs load
+    # as history instead of the text above
+    if snapshots is not None:
+        new_data.append(dump_snapshots(snapshots))
+
+    queue_row_upsert(new_data, date)
+
+
+# ---------------- RUN STATE ----------------
+# What fetch collected and brief generated, so each step can run as a
+# separate process (and publish can be retried without refetching).
+RUN_STATE_PATH = os.path.join(CACHE_DIR, "run_state.json")
+
+
+def save_run_state(run):
+
+    os.makedirs(os.path.dirname(RUN_STATE_PATH) or ".", exist_ok=True)
+
+    tmp_path = RUN_STATE_PATH + ".tmp"
+
+    with open(tmp_path, "w") as f:
+        json.dump(run, f, default=encode_snapshot)
+
+    os.replace(tmp_path, RUN_STATE_PATH)
+
+
+def load_run_state():
+
+    try:
+        with open(RUN_STATE_PATH) as f:
+            return json.load(f, object_hook=decode_snapshot)
+
+    except (OSError, ValueError):
+        return None
+
+
+# ---------------- INCREMENTAL MODE ----------------
+# For re-runs during the session. Every collected section is
+# fingerprinted. Sections that cannot have changed since the previous
+# run on the same report date are reused instead of refetched: the sheet
+# history, and NSE flows once they cover the session. A brief is only
+# regenerated when its news set, its flows or its session changed, or
+# when any of its prices moved more than BRIEF_PRICE_THRESHOLD_PCT since
+# the brief was written; otherwise the previous brief stands. With
+# nothing changed at all, publishing is skipped too.
+BRIEF_INCREMENTAL = os.getenv("BRIEF_INCREMENTAL", "").lower() in ("1", "true", "yes")
+BRIEF_PRICE_THRESHOLD_PCT = float(os.getenv("BRIEF_PRICE_THRESHOLD_PCT", "0.5"))
+
+
+def fingerprint(value):
+    return hashlib.sha1(dump_snapshots(value).encode("utf-8")).hexdigest()[:16]
+
+
+def section_fingerprints(collected):
+
+    # The news section is fingerprinted by its set of links, so text
+    # re-extracted for the same stories does not count as a change
+    fingerprints = {}
+
+    for name, value in collected.items():
+
+        if name == "news" and value is not None:
+            value = sorted(article["link"] for article in value)
+
+        fingerprints[name] = fingerprint(value)
+
+    return fingerprints
+
+
+def reusable_sources(previous):
+
+    # name -> value carried over from the previous run of the same day
+    if previous is None or previous["report_date"] != report_date():
+        return {}
+
+    collected = previous["collected"]
+    reused = {}
+
+    if collected.get("history") is not None:
+        reused["history"] = collected["history"]
+
+    flows = collected.get("flows")
+    market = collected.get("market")
+
+    # Flows are final once NSE has published them for the session
+    if flows is not None and not flows.error and market is not None \
+            and flows.date == market.trade_date:
+        reused["flows"] = flows
+
+    return reused
+
+
+def brief_inputs(run, config, values):
+
+    # What a brief is written from: session, closes, news links, flows
+    if "market" in config.sources:
+
+        quotes = []
+
+        for snapshot in (values["market"], values["global"]):
+            if snapshot is not None:
+                quotes.extend(snapshot.quotes)
+
+        trade_date = values["trade_date"]
+        articles = values["news_articles"]
+        flows = fingerprint(values["flow_snapshot"])
+
+    else:
+
+        snapshot = run["collected"].get(f"quotes.{config.name}")
+
+        quotes = snapshot.quotes if snapshot else []
+        trade_date = snapshot.trade_date if snapshot else "Unknown"
+        articles = brief_articles(run["collected"].get("news"), config)
+        flows = None
+
+    return {
+        "trade_date": trade_date,
+        "closes": {quote.name: quote.close for quote in quotes},
+        "news": sorted(article["link"] for article in articles or []),
+        "flows": flows
+    }
+
+
+def brief_changes(previous, current, threshold=BRIEF_PRICE_THRESHOLD_PCT):
+
+    # Reasons to regenerate a brief; empty when the previous one stands
+    if previous is None:
+        return ["no previous brief"]
+
+    reasons = []
+
+    if previous["trade_date"] != current["trade_date"]:
+        reasons.append("new session")
+
+    new_articles = set(current["news"]) - set(previous["news"])
+
+    if new_articles:
+        reasons.append(f"{len(new_articles)} new articles")
+
+    if previous["flows"] != current["flows"]:
+        reasons.append("flows changed")
+
+    for name, close in current["closes"].items():
+
+        before = previous["closes"].get(name)
+
+        if before and close is not None:
+
+            move = (close / before - 1) * 100
+
+            if abs(move) > threshold:
+                reasons.append(f"{name} {move:+.2f}%")
+
+    return reasons
+
+
+# ---------------- PIPELINE STEPS ----------------
+def run_fetch(configs, previous=None):
+
+    # previous: the last run state, for incremental runs
+    global _active_briefs
+
+    _active_briefs = configs
+
+    reused = reusable_sources(previous)
+
+    sources = {
+        name: source
+        for name, source in pipeline_sources(configs).items()
+        if name not in reused
+    }
+
+    for name in reused:
+        print("SOURCE REUSED:", name)
+        count("sources_reused")
+
+    collected, timings = collect_sources(sources)
+    collected.update(reused)
+
+    run = {
+        "report_date": report_date(),
+        "briefs_selected": [config.name for config in configs],
+        "collected": collected,
+        "collection": timings,
+        "fingerprints": section_fingerprints(collected)
+    }
+
+    # Same report date: keep the briefs and what they were written from,
+    # so unchanged briefs can stand
+    if previous is not None and previous["report_date"] == run["report_date"]:
+        run["briefs"] = previous.get("briefs", {})
+        run["brief_inputs"] = previous.get("brief_inputs", {})
+        run["previous_fingerprints"] = previous.get("fingerprints")
+
+    save_run_state(run)
+
+    return run
+
+
+def run_briefs(run, configs, values, stream=BRIEF_STREAM, incremental=False):
+
+    # Prompt assembly and the OpenAI calls fan out across briefs, at
+    # most BRIEF_MAX_CONCURRENCY at a time. The OpenAI token bucket
+    # spaces the requests out and the client backs off on 429s. Only a
+    # lone brief streams to stdout, so output never interleaves.
+    briefs = run.setdefault("briefs", {})
+    inputs = run.setdefault("brief_inputs", {})
+
+    current = {config.name: brief_inputs(run, config, values) for config in configs}
+    pending = []
+
+    for config in configs:
+
+        reasons = brief_changes(inputs.get(config.name), current[config.name])
+
+        if incremental and config.name in briefs and not reasons:
+            print(f"BRIEF UNCHANGED: {config.name}")
+            count("briefs_reused")
+            continue
+
+        if incremental:
+            print(f"BRIEF CHANGED: {config.name}: {', '.join(reasons)}")
+
+        pending.append(config)
+
+    run["regenerated"] = [config.name for config in pending]
+
+    if not pending:
+        save_run_state(run)
+        return run
+
+    configs = pending
+    single = len(configs) == 1
+
+    def generate(config):
+        with timed(f"brief.{config.name}"):
+            return generate_ai_brief(
+                brief_input(run, config, values),
+                stream=stream,
+                config=config,
+                stdout=single
+            )
+
+    def print_header(config):
+        print("===================================")
+        print(f"{config.title.upper()} – AI")
+        print("DATE:", run["report_date"])
+        print("===================================")
+
+    if single:
+        print_header(configs[0])
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(BRIEF_MAX_CONCURRENCY, len(configs))))
+
+    futures = {config.name: executor.submit(generate, config) for config in configs}
+
+    for config in configs:
+
+        try:
+            briefs[config.name] = futures[config.name].result()
+
+        except Exception as e:
+            print(f"BRIEF FAILED: {config.name}: {e}")
+            continue
+
+        inputs[config.name] = current[config.name]
+
+        if not single:
+            print_header(config)
+
+        if not (single and stream):
+            print(briefs[config.name])
+
+    executor.shutdown()
+
+    save_run_state(run)
+
+    return run
+
+
+def run_publish(run, configs, values):
+
+    briefs = run.get("briefs", {})
+
+    for config in configs:
+
+        if not config.publish or config.name not in briefs:
+            continue
+
+        if "market" in config.sources:
+
+            update_google_sheet(
+                run["report_date"],
+                values["market_data"],
+                values["global_data"],
+                values["flows"],
+                values["news_data"],
+                briefs[config.name],
+                {
+                    "market": values["market"],
+                    "global": values["global"],
+                    "flows": values["flow_snapshot"]
+                }
+            )
+            update_Indicator_history(values)
+
+        else:
+
+            snapshot = run["collected"].get(f"quotes.{config.name}")
+
+            queue_row_upsert(
+                [
+                    run["report_date"],
+                    render_snapshot(snapshot),
+                    briefs[config.name],
+                    dump_snapshots({"market": snapshot})
+                ],
+                run["report_date"],
+                config.sheet
+            )
+
+    flush_sheet_writes()
+
+    return run
+
+
+# ---------------- CLI ----------------
+def build_parser():
+
+    parser = argparse.ArgumentParser(description="Daily market brief")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="run",
+        choices=["run", "fetch", "brief", "publish", "backfill"],
+        help="run (default) does fetch, brief and publish in one go"
+    )
+    parser.add_argument("--stream", action="store_true", default=BRIEF_STREAM,
+                        help="stream the brief to the output sinks")
+    parser.add_argument("--incremental", action="store_true", default=BRIEF_INCREMENTAL,
+                        help="reuse unchanged sections and briefs from the last run today")
+    parser.add_argument("--briefs",
+                        help=f"comma-separated briefs or 'all' (default: BRIEFS env, "
+                             f"else {BRIEF_NAMES}; brief/publish reuse the fetched set); "
+                             f"known: {', '.join(BRIEFS)}")
+    parser.add_argument("--start", type=datetime.date.fromisoformat,
+                        help="backfill: first date, YYYY-MM-DD")
+    parser.add_argument("--end", type=datetime.date.fromisoformat,
+                        default=datetime.date.today(),
+                        help="backfill: last date, YYYY-MM-DD (default today)")
+
+    return parser
+
+
+def parse_args(argv=None, parser=None):
+
+    parser = parser or build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == "backfill" and args.start is None:
+        parser.error("backfill needs --start")
+
+    if args.briefs is not None:
+        try:
+            select_briefs(args.briefs)
+        except ValueError as e:
+            parser.error(str(e))
+
+    return args
+
+
+def main(argv=None):
+
+    parser = build_parser()
+    args = parse_args(argv, parser)
+
+    # The run report is written however the command ends, so the runs
+    # that fail leave the most to diagnose
+    report = {"command": args.command, "error": None}
+
+    try:
+        return run_command(args, parser, report)
+
+    except Exception as e:
+        report["error"] = f"{type(e).__name__}: {e}"
+        raise
+
+    finally:
+        write_run_report(report)
+
+
+def run_command(args, parser, report):
+
+    # Fills in report as it goes; returns the exit code
+    if args.command == "backfill":
+        report["backfilled_rows"] = backfill_indicator_history(args.start, args.end)
+        return 0
+
+    if args.command in ("run", "fetch"):
+        configs = select_briefs(args.briefs or BRIEF_NAMES)
+        run = run_fetch(configs, load_run_state() if args.incremental else None)
+    else:
+        run = load_run_state()
+
+        if run is None:
+            report["error"] = f"No fetched data in {RUN_STATE_PATH}; run fetch first."
+            print(report["error"])
+            return 1
+
+        configs = select_briefs(args.briefs or ",".join(run["briefs_selected"]))
+
+        # brief/publish only read what fetch collected for its briefs
+        unfetched = [config.name for config in configs if config.name not in run["briefs_selected"]]
+
+        if unfetched:
+            parser.error(
+                f"not fetched: {', '.join(unfetched)} (fetched: {', '.join(run['briefs_selected'])}); "
+                f"run fetch --briefs {args.briefs} first"
+            )
+
+    report["collection"] = run["collection"]
+
+    # Only the India brief reads the Sheet1 snapshot set
+    if any("market" in config.sources for config in configs):
+        values = prepare_run(run["collected"])
+    else:
+        values = None
+
+    if args.command in ("run", "brief"):
+        run = run_briefs(run, configs, values, stream=args.stream, incremental=args.incremental)
+
+    if args.command in ("run", "publish"):
+
+        if not run.get("briefs"):
+            report["error"] = "No brief generated yet; run brief first."
+            print(report["error"])
+            return 1
+
+        if args.incremental and not run.get("regenerated") \
+                and run["fingerprints"] == run.get("previous_fingerprints"):
+            print("NOTHING CHANGED: skipping publish")
+        else:
+            run_publish(run, configs, values)
 
-        print(f"Added new row for {date}")
+    return 0
 
-# ---------------- EXECUTE GOOGLE SHEET UPDATE ----------------
 
-update_google_sheet(
-    today,
-    market_data,
-    global_data,
-    fii_dii_data,
-    news_data,
-    ai_output
-) 
-update_Indicator_history()
+if __name__ == "__main__":
+    sys.exit(main())